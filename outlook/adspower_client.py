@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+AdsPower 本地 API 客户端
+基于连接池复用的 requests.Session, 每次调用都有超时, 失败时有限次退避重试(带随机抖动),
+限制同时启动的 profile 数量, 并按接口统计调用延迟
+"""
+import time
+import random
+import logging
+import threading
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = "http://local.adspower.net:50325"
+START_PATH = "/api/v2/browser-profile/start"
+STOP_PATH = "/api/v2/browser-profile/stop"
+ACTIVE_PATH = "/api/v1/browser/local-active"
+
+
+class AdsPowerError(Exception):
+    """
+    AdsPower API 返回错误或请求失败
+    """
+
+
+class AdsPowerUnavailableError(AdsPowerError):
+    """
+    AdsPower 本身不可用: 连接失败、超时、重试耗尽或返回内容无法解析; 与具体 profile 无关
+    接口返回 code != 0 的业务错误(profile 不存在或被占用、代理失败等)仍为 AdsPowerError
+    """
+
+
+class _RetryableError(AdsPowerError):
+    """
+    可重试的错误: 限流、服务端错误
+    """
+
+
+class EndpointStats:
+    """
+    单个接口的调用统计, 保留最近 window 次调用的延迟用于计算分位数
+    """
+    def __init__(self, window=500):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds, ok):
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.samples.append(seconds)
+
+    def snapshot(self):
+        samples = sorted(self.samples)
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg": self.total_seconds / self.count if self.count else 0.0,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "max": self.max_seconds,
+        }
+
+
+class AdsPowerClient:
+    """
+    AdsPower 本地 API 客户端, 线程安全, 同一个 API 地址的所有调用方应共享一个实例(见 get_client)
+    """
+    def __init__(self, base_url=DEFAULT_API_URL, connect_timeout=3, read_timeout=60,
+                 max_retries=3, backoff=0.5, max_backoff=8, max_concurrent_starts=3, pool_size=16):
+        """
+        connect_timeout / read_timeout: 每次请求的连接/读取超时秒数
+        max_retries: 网络错误、限流和 5xx 时的最大重试次数
+        backoff / max_backoff: 指数退避的基数和上限秒数, 实际等待在 [0, 退避值] 内随机
+        max_concurrent_starts: 同时进行中的 profile 启动请求上限
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.start_limiter = threading.BoundedSemaphore(max_concurrent_starts)
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.observers = []
+        logger.info("初始化 AdsPowerClient, API 地址: %s, 超时 %s, 最大重试 %d, 最大并发启动 %d",
+                    self.base_url, self.timeout, max_retries, max_concurrent_starts)
+
+    def add_observer(self, observer):
+        """
+        注册请求回调, 每次请求(含重试)结束后以 (path, seconds, ok, error_type) 调用
+        """
+        self.observers.append(observer)
+
+    def _record(self, path, seconds, ok, error=None):
+        with self.stats_lock:
+            stats = self.stats.setdefault(path, EndpointStats())
+            stats.record(seconds, ok)
+        for observer in self.observers:
+            try:
+                observer(path, seconds, ok, type(error).__name__ if error else None)
+            except Exception as e:
+                logger.error("AdsPower 请求回调出错: %s", e)
+
+    def _request(self, method, path, payload=None, params=None, timeout=None):
+        """
+        发送请求并返回响应 JSON, 网络错误/限流/5xx 按退避重试, 业务错误直接抛出 AdsPowerError
+        """
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                logger.debug("AdsPower 请求 %s %s, 参数: %s", method, url, payload or params)
+                response = self.session.request(method, url, json=payload, params=params,
+                                                timeout=timeout or self.timeout)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise _RetryableError(f"API 请求失败({response.status_code}): {response.text}")
+                if response.status_code != 200:
+                    raise AdsPowerError(f"API 请求失败({response.status_code}): {response.text}")
+                data = response.json()
+                if data.get("code") != 0:
+                    msg = data.get("msg", "")
+                    # 本地 API 有每秒请求数限制, 超限时可以重试
+                    if "too many request" in str(msg).lower():
+                        raise _RetryableError(f"API 限流: {msg}")
+                    raise AdsPowerError(msg)
+                self._record(path, time.perf_counter() - start, True)
+                return data
+            except (requests.ConnectionError, requests.Timeout, _RetryableError) as e:
+                self._record(path, time.perf_counter() - start, False, e)
+                if attempt >= self.max_retries:
+                    raise AdsPowerUnavailableError(f"{path} 重试 {self.max_retries} 次后仍失败: {e}") from e
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                logger.warning("AdsPower 请求 %s 失败(第 %d 次), %.2f 秒后重试: %s", path, attempt + 1, delay, e)
+                time.sleep(delay)
+            except AdsPowerError as e:
+                self._record(path, time.perf_counter() - start, False, e)
+                raise
+            except ValueError as e:
+                self._record(path, time.perf_counter() - start, False, e)
+                raise AdsPowerUnavailableError(f"API 返回内容无法解析: {e}") from e
+
+    def start_profile(self, profile_id, proxy_detection="0", **extra):
+        """
+        启动 profile, 返回 API 的 data 字段(包含 ws.selenium 调试地址)
+        同时进行中的启动请求数受 max_concurrent_starts 限制
+        """
+        payload = {"profile_id": profile_id, "proxy_detection": proxy_detection}
+        payload.update(extra)
+        with self.start_limiter:
+            data = self._request("POST", START_PATH, payload)
+        return data["data"]
+
+    def stop_profile(self, profile_id):
+        """
+        关闭 profile
+        """
+        self._request("POST", STOP_PATH, {"profile_id": profile_id})
+
+    def active_profiles(self):
+        """
+        查询本机 AdsPower 当前已打开的 profile, 返回 profile_id 集合
+        """
+        data = self._request("GET", ACTIVE_PATH)
+        profiles = (data.get("data") or {}).get("list") or []
+        return {str(item.get("user_id") or item.get("profile_id")) for item in profiles
+                if item.get("user_id") or item.get("profile_id")}
+
+    def latency_stats(self):
+        """
+        各接口的调用次数、错误数和延迟(avg/p50/p95/max, 秒)
+        """
+        with self.stats_lock:
+            return {path: stats.snapshot() for path, stats in self.stats.items()}
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url=DEFAULT_API_URL, **kwargs):
+    """
+    获取指定 API 地址的共享客户端, 首次调用时按 kwargs 创建
+    """
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = AdsPowerClient(base_url, **kwargs)
+            _clients[base_url] = client
+        return client
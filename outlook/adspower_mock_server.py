@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+AdsPower 本地 API 替身服务, 用于在普通 Linux 主机上离线压测调度器和 OutlookEmailFetcher
+实现 /api/v2/browser-profile/start 和 /stop, 返回与 AdsPower 相同结构的 JSON (code, msg, data.ws.selenium),
+以及查询已打开 profile 的 /api/v1/browser/local-active,
+启动 profile 时拉起一个本地 headless Chromium 并返回其调试地址
+
+用法:
+    python adspower_mock_server.py --port 50325 --latency-ms 200 --error-rate 0.05 --max-profiles 100
+    python adspower_mock_server.py --no-chrome     # 不启动浏览器, 只压测 API 和调度
+"""
+import os
+import json
+import time
+import random
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from urllib.request import urlopen
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+CHROME_CANDIDATES = ("chromium", "chromium-browser", "google-chrome", "google-chrome-stable", "chrome")
+
+
+def find_chrome():
+    """在 PATH 中查找可用的 Chromium/Chrome"""
+    for name in CHROME_CANDIDATES:
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def _free_port():
+    """获取一个空闲的本地端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class MockProfile:
+    """
+    一个已启动的模拟 profile
+    """
+    def __init__(self, profile_id, port, process=None, user_data_dir=None):
+        self.profile_id = profile_id
+        self.port = port
+        self.process = process
+        self.user_data_dir = user_data_dir
+        self.start_time = time.time()
+
+    def response_data(self):
+        """与 AdsPower start 接口一致的 data 字段"""
+        return {
+            "ws": {
+                "selenium": f"127.0.0.1:{self.port}",
+                "puppeteer": f"ws://127.0.0.1:{self.port}/devtools/browser/{self.profile_id}",
+            },
+            "debug_port": str(self.port),
+            "webdriver": shutil.which("chromedriver") or "",
+        }
+
+    def close(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.user_data_dir:
+            shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+
+class MockAdsPowerState:
+    """
+    模拟 AdsPower 的 profile 状态: 注入延迟和错误, 限制同时打开的 profile 数量
+    """
+    def __init__(self, latency_ms=0, latency_jitter_ms=0, error_rate=0.0, max_profiles=100,
+                 chrome_path=None, launch_chrome=True, chrome_ready_timeout=15):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.max_profiles = max_profiles
+        self.launch_chrome = launch_chrome
+        self.chrome_path = chrome_path or (find_chrome() if launch_chrome else None)
+        self.chrome_ready_timeout = chrome_ready_timeout
+        self.profiles = {}
+        # 正在启动的 profile -> 启动完成(成功或失败)时置位的 Event
+        self.starting = {}
+        self.lock = threading.Lock()
+        if launch_chrome and not self.chrome_path:
+            raise RuntimeError("未找到 Chromium/Chrome, 请通过 --chrome-path 指定或使用 --no-chrome")
+
+    def delay(self):
+        """按配置注入接口延迟"""
+        seconds = (self.latency_ms + random.uniform(0, self.latency_jitter_ms)) / 1000
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def inject_error(self):
+        """按 error_rate 随机返回错误"""
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def _launch(self, profile_id):
+        """启动 headless Chromium 并等待调试端口可用"""
+        port = _free_port()
+        user_data_dir = tempfile.mkdtemp(prefix=f"mock-ads-{profile_id}-")
+        process = subprocess.Popen(
+            [
+                self.chrome_path,
+                "--headless=new",
+                f"--remote-debugging-port={port}",
+                f"--user-data-dir={user_data_dir}",
+                "--no-first-run",
+                "--no-default-browser-check",
+                "--disable-gpu",
+                "--no-sandbox",
+                "--disable-dev-shm-usage",
+                "about:blank",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        profile = MockProfile(profile_id, port, process, user_data_dir)
+        deadline = time.monotonic() + self.chrome_ready_timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                break
+            try:
+                with urlopen(f"http://127.0.0.1:{port}/json/version", timeout=1):
+                    return profile
+            except OSError:
+                time.sleep(0.1)
+        profile.close()
+        raise RuntimeError(f"Chromium 在 {self.chrome_ready_timeout} 秒内未就绪")
+
+    def start(self, profile_id):
+        """
+        返回 (code, msg, data)
+        同一 profile 正在启动时, 并发的请求等待这次启动完成后返回同一个浏览器, 不会重复启动;
+        正在启动的 profile 计入 max_profiles
+        """
+        while True:
+            with self.lock:
+                profile = self.profiles.get(profile_id)
+                if profile is not None:
+                    return 0, "success", profile.response_data()
+                launching = self.starting.get(profile_id)
+                if launching is None:
+                    if len(self.profiles) + len(self.starting) >= self.max_profiles:
+                        return -1, f"Maximum number of open browsers reached: {self.max_profiles}", {}
+                    launching = self.starting[profile_id] = threading.Event()
+                    break
+            if not launching.wait(self.chrome_ready_timeout + 5):
+                return -1, f"profile {profile_id} is starting, try again later", {}
+        try:
+            if self.launch_chrome:
+                profile = self._launch(profile_id)
+            else:
+                profile = MockProfile(profile_id, _free_port())
+        except Exception as e:
+            with self.lock:
+                self.starting.pop(profile_id, None)
+            launching.set()
+            logger.error("启动模拟 profile %s 失败: %s", profile_id, e)
+            return -1, str(e), {}
+        with self.lock:
+            self.profiles[profile_id] = profile
+            self.starting.pop(profile_id, None)
+            active = len(self.profiles)
+        launching.set()
+        logger.info("模拟 profile %s 已启动, 端口 %d, 当前打开 %d", profile_id, profile.port, active)
+        return 0, "success", profile.response_data()
+
+    def stop(self, profile_id):
+        """返回 (code, msg, data)"""
+        with self.lock:
+            if profile_id in self.starting:
+                return -1, f"profile {profile_id} is starting, try again later", {}
+            profile = self.profiles.pop(profile_id, None)
+            if profile is None:
+                return -1, f"profile {profile_id} is not open", {}
+        profile.close()
+        logger.info("模拟 profile %s 已关闭", profile_id)
+        return 0, "success", {}
+
+    def active(self):
+        """与 AdsPower local-active 接口一致的 data 字段"""
+        with self.lock:
+            profiles = list(self.profiles.values())
+        return {"list": [{"user_id": p.profile_id, **p.response_data()} for p in profiles]}
+
+    def stop_all(self):
+        """关闭所有 profile, 先等待正在启动的 profile 启动完成, 避免其浏览器在清理之后才注册而泄漏"""
+        with self.lock:
+            launching = list(self.starting.values())
+        for event in launching:
+            event.wait(self.chrome_ready_timeout + 5)
+        with self.lock:
+            profiles = list(self.profiles.values())
+            self.profiles.clear()
+        for profile in profiles:
+            profile.close()
+
+
+class MockAdsPowerHandler(BaseHTTPRequestHandler):
+    """
+    处理 AdsPower API 请求, 状态保存在 server.state
+    """
+    def _send_json(self, body, status=200):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def do_GET(self):
+        state = self.server.state
+        state.delay()
+        if self.path.split("?")[0] != "/api/v1/browser/local-active":
+            self._send_json({"code": -1, "msg": f"unknown path {self.path}"}, status=404)
+            return
+        self._send_json({"code": 0, "msg": "success", "data": state.active()})
+
+    def do_POST(self):
+        state = self.server.state
+        payload = self._read_json()
+        profile_id = str(payload.get("profile_id", ""))
+        state.delay()
+        if self.path == "/api/v2/browser-profile/start":
+            handler = state.start
+        elif self.path == "/api/v2/browser-profile/stop":
+            handler = state.stop
+        else:
+            self._send_json({"code": -1, "msg": f"unknown path {self.path}"}, status=404)
+            return
+        if not profile_id:
+            self._send_json({"code": -1, "msg": "profile_id is required"})
+            return
+        if state.inject_error():
+            self._send_json({"code": -1, "msg": "mock injected error"})
+            return
+        code, msg, data = handler(profile_id)
+        self._send_json({"code": code, "msg": msg, "data": data})
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def start_mock_server(host="127.0.0.1", port=0, **state_kwargs):
+    """
+    在后台线程启动替身服务, 返回 (server, base_url); 用完后调用 server.shutdown() 和 server.state.stop_all()
+    """
+    server = ThreadingHTTPServer((host, port), MockAdsPowerHandler)
+    server.daemon_threads = True
+    server.state = MockAdsPowerState(**state_kwargs)
+    thread = threading.Thread(target=server.serve_forever, name="adspower-mock", daemon=True)
+    thread.start()
+    base_url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    logger.info("AdsPower 替身服务已启动: %s", base_url)
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AdsPower 本地 API 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50325)
+    parser.add_argument("--latency-ms", type=float, default=0, help="每个请求的固定延迟(毫秒)")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0, help="在固定延迟上叠加的随机延迟上限(毫秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 code=-1 的概率")
+    parser.add_argument("--max-profiles", type=int, default=100, help="同时打开的 profile 上限")
+    parser.add_argument("--chrome-path", default=os.getenv("MOCK_CHROME_PATH"), help="Chromium 可执行文件路径")
+    parser.add_argument("--no-chrome", action="store_true", help="不启动浏览器, 只模拟 API")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s-%(levelname)s - %(module)s: %(message)s')
+    server, base_url = start_mock_server(
+        args.host, args.port,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        max_profiles=args.max_profiles,
+        chrome_path=args.chrome_path,
+        launch_chrome=not args.no_chrome,
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        logger.info("收到 KeyboardInterrupt, 关闭替身服务")
+    finally:
+        server.shutdown()
+        server.state.stop_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+"""
+fetch_outlook_emails 端到端压测
+在本地提供静态的 Outlook 收件箱夹具(与线上相同的 [role='option'], .m9Rge, .ESO13 span,
+div[role='document'] 等结构, 邮件数和广告数可配置), 通过 AdsPower 替身服务启动 headless Chromium,
+统计每个阶段的耗时: navigate, list_wait, ad_filter, open_message, extract_body, db_insert 等
+
+用法:
+    python bench_fetch.py --iterations 20 --messages 50 --ads 5
+    python bench_fetch.py --fixture recorded_inbox.html      # 使用录制的收件箱 HTML
+    python bench_fetch.py --with-db                          # 同时压测写入 outlook_email_content
+    python bench_fetch.py --json result.json                 # 保存结果, 便于对比回归
+    python bench_fetch.py --compare-wait --iterations 10     # 对比固定等待和条件等待, 输出每个账号节省的时间
+    python bench_fetch.py --compare-blocking                 # 对比普通模式和轻量模式的传输字节数和列表就绪时间
+"""
+import json
+import time
+import random
+import logging
+import copy
+import argparse
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from adspower_mock_server import start_mock_server
+from read_email import OutlookEmailFetcher, PostgresDBManager, WaitPolicy
+
+
+logger = logging.getLogger(__name__)
+
+# 最小的 1x1 PNG, 作为广告图标
+AD_ICON_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+PHASE_ORDER = (
+    "adspower_start", "chrome_attach", "navigate", "list_wait", "time_to_list", "ad_filter",
+    "open_message", "extract_body", "dwell", "teardown", "adspower_stop", "db_insert", "total",
+)
+
+# 夹具中模拟的附属资源大小(字节), 与线上收件箱页面的量级相当
+AVATAR_BYTES = 24 * 1024
+FONT_BYTES = 120 * 1024
+AD_FRAME_BYTES = 30 * 1024
+TELEMETRY_BYTES = 512
+
+INBOX_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Outlook Inbox Fixture</title>
+<style>
+  @font-face { font-family: 'FixtureSegoe'; src: url('/static/fonts/segoeui.woff2') format('woff2'); }
+  body { font-family: 'FixtureSegoe', sans-serif; display: flex; margin: 0; }
+  .avatar { width: 24px; height: 24px; margin-right: 4px; }
+  #list-pane { width: 40%%; }
+  #reading-pane { flex: 1; padding: 12px; }
+  [role='option'] { border-bottom: 1px solid #ddd; padding: 6px; cursor: pointer; }
+  .m9Rge { color: #fff; background: #666; padding: 0 4px; margin-right: 4px; }
+</style>
+</head>
+<body>
+<div id="list-pane"></div>
+<div id="reading-pane"></div>
+<iframe src="/ads/adsdk/frame.html" width="300" height="250" title="ad"></iframe>
+<script>
+const MESSAGES = %(messages)s;
+const LIST_DELAY_MS = %(list_delay_ms)d;
+const OPEN_DELAY_MS = %(open_delay_ms)d;
+
+function openMessage(index) {
+  setTimeout(function () {
+    const pane = document.getElementById('reading-pane');
+    pane.replaceChildren();
+    const doc = document.createElement('div');
+    doc.setAttribute('role', 'document');
+    doc.textContent = MESSAGES[index].body;
+    pane.appendChild(doc);
+  }, OPEN_DELAY_MS);
+}
+
+function renderList() {
+  const list = document.createElement('div');
+  list.setAttribute('role', 'listbox');
+  MESSAGES.forEach(function (m, index) {
+    const option = document.createElement('div');
+    option.setAttribute('role', 'option');
+    option.setAttribute('data-convid', m.convid);
+    const avatar = document.createElement('img');
+    avatar.className = 'avatar';
+    avatar.src = '/static/avatar/' + index + '.png';
+    option.appendChild(avatar);
+    const sender = document.createElement('div');
+    sender.className = 'ESO13';
+    const senderName = document.createElement('span');
+    senderName.textContent = m.sender;
+    sender.appendChild(senderName);
+    option.appendChild(sender);
+    if (m.ad_label) {
+      const label = document.createElement('span');
+      label.className = 'm9Rge';
+      label.textContent = 'Ad';
+      option.appendChild(label);
+    }
+    if (m.ad_icon) {
+      const icon = document.createElement('img');
+      icon.src = '/static/ads-olk-icon.png';
+      option.appendChild(icon);
+    }
+    const subject = document.createElement('span');
+    subject.setAttribute('title', m.subject);
+    subject.textContent = m.subject;
+    subject.addEventListener('click', function () { openMessage(index); });
+    option.appendChild(subject);
+    const received = document.createElement('span');
+    received.className = 'received';
+    received.textContent = m.received;
+    option.appendChild(received);
+    list.appendChild(option);
+  });
+  document.getElementById('list-pane').appendChild(list);
+  fetch('/OneCollector/1.0/?event=list_rendered&t=' + Date.now()).catch(function () {});
+}
+
+setTimeout(renderList, LIST_DELAY_MS);
+</script>
+</body>
+</html>
+"""
+
+
+def build_messages(message_count, ad_count, seed=0):
+    """
+    生成收件箱夹具的邮件列表, 广告按三种线上特征(Ad 标签、广告图标、Microsoft Outlook 发件人)轮流出现
+    """
+    rng = random.Random(seed)
+    ad_positions = set(rng.sample(range(message_count), min(ad_count, message_count)))
+    messages = []
+    ad_index = 0
+    for i in range(message_count):
+        is_ad = i in ad_positions
+        kind = ad_index % 3 if is_ad else None
+        if is_ad:
+            ad_index += 1
+        messages.append({
+            "convid": f"conv-{seed}-{i:05d}",
+            "sender": "Microsoft Outlook" if kind == 2 else f"Sender {i}",
+            "subject": f"{'Sponsored' if is_ad else 'Message'} {i}: verification code {rng.randint(100000, 999999)}",
+            "received": f"{(9 + i // 60) % 24:02d}:{i % 60:02d}",
+            "body": " ".join(f"word{rng.randint(0, 9999)}" for _ in range(rng.randint(40, 400))),
+            "ad_label": kind == 0,
+            "ad_icon": kind == 1,
+        })
+    return messages
+
+
+def render_inbox(messages, list_delay_ms=300, open_delay_ms=150):
+    """渲染收件箱夹具 HTML"""
+    return INBOX_TEMPLATE % {
+        "messages": json.dumps(messages, ensure_ascii=False),
+        "list_delay_ms": list_delay_ms,
+        "open_delay_ms": open_delay_ms,
+    }
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    def _resource(self):
+        """按路径返回 (资源类别, 内容, Content-Type)"""
+        if self.path.startswith("/static/ads-olk-icon.png"):
+            return "image", AD_ICON_PNG, "image/png"
+        if self.path.startswith("/static/avatar/"):
+            # PNG 末尾的填充数据会被浏览器忽略, 只用于模拟头像大小
+            return "image", AD_ICON_PNG + b"\0" * AVATAR_BYTES, "image/png"
+        if self.path.startswith("/static/fonts/"):
+            return "font", b"\0" * FONT_BYTES, "font/woff2"
+        if self.path.startswith("/ads/"):
+            return "ad", b"<html><body>" + b" " * AD_FRAME_BYTES + b"</body></html>", "text/html"
+        if self.path.startswith("/OneCollector/"):
+            return "telemetry", b"\0" * TELEMETRY_BYTES, "application/octet-stream"
+        return "document", self.server.inbox_html.encode("utf-8"), "text/html; charset=utf-8"
+
+    def do_GET(self):
+        kind, body, content_type = self._resource()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.stats_lock:
+            self.server.bytes_sent[kind] = self.server.bytes_sent.get(kind, 0) + len(body)
+            self.server.requests[kind] = self.server.requests.get(kind, 0) + 1
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def start_fixture_server(inbox_html, host="127.0.0.1", port=0):
+    """
+    在后台线程提供收件箱夹具, 返回 (server, inbox_url)
+    server.bytes_sent / server.requests 按资源类别统计实际发送的字节数和请求数
+    """
+    server = ThreadingHTTPServer((host, port), _FixtureHandler)
+    server.daemon_threads = True
+    server.inbox_html = inbox_html
+    server.bytes_sent = {}
+    server.requests = {}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="inbox-fixture", daemon=True).start()
+    return server, f"http://{server.server_address[0]}:{server.server_address[1]}/mail/"
+
+
+class PhaseCollector:
+    """
+    汇总每次读取的阶段耗时, 作为 OutlookEmailFetcher 的阶段回调
+    """
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, email_address, ads_browser_id, timings):
+        with self.lock:
+            for name, seconds in timings.items():
+                self.samples.setdefault(name, []).append(seconds)
+            # 从开始导航到邮件列表出现的时间
+            if "navigate" in timings and "list_wait" in timings:
+                self.samples.setdefault("time_to_list", []).append(timings["navigate"] + timings["list_wait"])
+
+    def add(self, name, seconds):
+        self(None, None, {name: seconds})
+
+    def summary(self):
+        """每个阶段的 n/mean/p50/p95/max (秒)"""
+        result = {}
+        with self.lock:
+            items = {name: sorted(values) for name, values in self.samples.items()}
+        for name, values in items.items():
+            result[name] = {
+                "n": len(values),
+                "mean": sum(values) / len(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                "max": values[-1],
+            }
+        return result
+
+
+def print_report(summary, wall_seconds, completed):
+    """打印各阶段耗时表和吞吐量"""
+    names = [name for name in PHASE_ORDER if name in summary]
+    names += sorted(name for name in summary if name not in PHASE_ORDER)
+    print(f"{'phase':<16}{'n':>6}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}")
+    for name in names:
+        row = summary[name]
+        print(f"{name:<16}{row['n']:>6}{row['mean']:>10.3f}{row['p50']:>10.3f}{row['p95']:>10.3f}{row['max']:>10.3f}")
+    rate = completed / wall_seconds * 3600 if wall_seconds > 0 else 0.0
+    print(f"完成 {completed} 次读取, 总耗时 {wall_seconds:.1f} 秒, 吞吐 {rate:.0f} 账号/小时")
+
+
+def run_benchmark(args):
+    """按命令行参数执行压测, 返回结果字典"""
+    if args.fixture:
+        with open(args.fixture, encoding="utf-8") as f:
+            inbox_html = f.read()
+    else:
+        messages = build_messages(args.messages, args.ads, args.seed)
+        inbox_html = render_inbox(messages, args.list_delay_ms, args.open_delay_ms)
+    fixture_server, inbox_url = start_fixture_server(inbox_html)
+
+    # 每个进行中的读取独占一个 profile, profile 数少于并发数时按并发数补足, 避免两个线程同时操作同一个浏览器
+    profile_count = max(args.profiles, args.concurrency)
+    free_profiles = queue.Queue()
+    for n in range(profile_count):
+        free_profiles.put(f"bench-{n}")
+
+    mock_server = None
+    api_url = args.adspower_url
+    if not api_url:
+        mock_server, api_url = start_mock_server(max_profiles=profile_count,
+                                                 chrome_path=args.chrome_path)
+
+    wait_policy = WaitPolicy(args.wait_policy, min_dwell=args.min_dwell, dwell_jitter=args.dwell_jitter)
+    fetcher = OutlookEmailFetcher(adspower_api_url=api_url, inbox_url=inbox_url, wait_policy=wait_policy,
+                                  block_resources=args.block_resources)
+    collector = PhaseCollector()
+    fetcher.add_phase_listener(collector)
+    db_lock = threading.Lock()
+    db_manager = PostgresDBManager() if args.with_db else None
+
+    def check(i):
+        ads_browser_id = free_profiles.get()
+        email_address = f"{ads_browser_id}@bench.local"
+        start = time.perf_counter()
+        try:
+            emails = fetcher.fetch_outlook_emails(email_address, ads_browser_id)
+        finally:
+            free_profiles.put(ads_browser_id)
+        if db_manager and emails:
+            insert_start = time.perf_counter()
+            with db_lock:
+                db_manager.insert_email_content(emails)
+            collector.add("db_insert", time.perf_counter() - insert_start)
+        collector.add("total", time.perf_counter() - start)
+        return len(emails)
+
+    wall_start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            read_counts = list(executor.map(check, range(args.iterations)))
+    finally:
+        wall_seconds = time.perf_counter() - wall_start
+        if db_manager:
+            db_manager.close_connection()
+        if mock_server:
+            mock_server.shutdown()
+            mock_server.state.stop_all()
+        fixture_server.shutdown()
+
+    summary = collector.summary()
+    bytes_sent = dict(fixture_server.bytes_sent)
+    total_bytes = sum(bytes_sent.values())
+    print(f"等待策略: {args.wait_policy}, 轻量模式: {'开' if args.block_resources else '关'}")
+    print_report(summary, wall_seconds, len(read_counts))
+    print(f"夹具共发送 {total_bytes / 1024:.0f} KB, 每个账号 {total_bytes / 1024 / max(1, len(read_counts)):.0f} KB, "
+          f"按类别: {', '.join(f'{kind} {size / 1024:.0f} KB' for kind, size in sorted(bytes_sent.items()))}")
+    return {
+        "args": vars(args),
+        "wall_seconds": wall_seconds,
+        "completed": len(read_counts),
+        "emails_read": sum(read_counts),
+        "phases": summary,
+        "bytes_sent": bytes_sent,
+        "requests": dict(fixture_server.requests),
+    }
+
+
+def compare_wait_policies(args):
+    """
+    依次用 fixed 和 condition 等待策略运行同样的压测, 输出每个账号节省的时间和吞吐变化
+    """
+    results = {}
+    for mode in ("fixed", "condition"):
+        mode_args = copy.copy(args)
+        mode_args.wait_policy = mode
+        results[mode] = run_benchmark(mode_args)
+        print()
+
+    def per_account(result):
+        total = result["phases"].get("total")
+        return total["mean"] if total else 0.0
+
+    def accounts_per_hour(result):
+        return result["completed"] / result["wall_seconds"] * 3600 if result["wall_seconds"] > 0 else 0.0
+
+    fixed, condition = results["fixed"], results["condition"]
+    saved = per_account(fixed) - per_account(condition)
+    fixed_rate, condition_rate = accounts_per_hour(fixed), accounts_per_hour(condition)
+    change = (condition_rate / fixed_rate - 1) * 100 if fixed_rate else 0.0
+    print(f"每个账号平均耗时: fixed {per_account(fixed):.2f} 秒, condition {per_account(condition):.2f} 秒, "
+          f"节省 {saved:.2f} 秒")
+    print(f"吞吐: fixed {fixed_rate:.0f} 账号/小时, condition {condition_rate:.0f} 账号/小时, 变化 {change:+.1f}%")
+    return {
+        "policies": results,
+        "saved_seconds_per_account": saved,
+        "accounts_per_hour": {"fixed": fixed_rate, "condition": condition_rate},
+        "accounts_per_hour_change_pct": change,
+    }
+
+
+def compare_resource_blocking(args):
+    """
+    依次在普通模式和轻量模式(屏蔽图片、字体、广告和遥测)下运行同样的压测,
+    输出每个账号的传输字节数和列表就绪时间(time_to_list)
+    """
+    results = {}
+    for blocking in (False, True):
+        mode_args = copy.copy(args)
+        mode_args.block_resources = blocking
+        results["lightweight" if blocking else "normal"] = run_benchmark(mode_args)
+        print()
+
+    def per_account_kb(result):
+        return sum(result["bytes_sent"].values()) / 1024 / max(1, result["completed"])
+
+    def time_to_list(result):
+        phase = result["phases"].get("time_to_list")
+        return (phase["p50"], phase["p95"]) if phase else (0.0, 0.0)
+
+    normal, lightweight = results["normal"], results["lightweight"]
+    normal_kb, lightweight_kb = per_account_kb(normal), per_account_kb(lightweight)
+    saved_pct = (1 - lightweight_kb / normal_kb) * 100 if normal_kb else 0.0
+    print(f"每个账号传输: 普通 {normal_kb:.0f} KB, 轻量 {lightweight_kb:.0f} KB, 减少 {saved_pct:.1f}%")
+    print("列表就绪时间 p50/p95: 普通 {:.2f}/{:.2f} 秒, 轻量 {:.2f}/{:.2f} 秒".format(
+        *time_to_list(normal), *time_to_list(lightweight)))
+    return {
+        "modes": results,
+        "kb_per_account": {"normal": normal_kb, "lightweight": lightweight_kb},
+        "bytes_saved_pct": saved_pct,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fetch_outlook_emails 端到端压测")
+    parser.add_argument("--iterations", type=int, default=10, help="读取次数")
+    parser.add_argument("--concurrency", type=int, default=1, help="并发读取线程数")
+    parser.add_argument("--profiles", type=int, default=1, help="模拟的 profile 数量, 少于并发数时按并发数计")
+    parser.add_argument("--messages", type=int, default=50, help="收件箱邮件数")
+    parser.add_argument("--ads", type=int, default=5, help="其中的广告邮件数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--list-delay-ms", type=int, default=300, help="夹具渲染邮件列表前的延迟")
+    parser.add_argument("--open-delay-ms", type=int, default=150, help="夹具点击邮件后显示正文前的延迟")
+    parser.add_argument("--fixture", help="使用录制的收件箱 HTML 文件代替生成的夹具")
+    parser.add_argument("--adspower-url", help="使用已有的 AdsPower(或替身服务)地址, 默认在进程内启动替身服务")
+    parser.add_argument("--chrome-path", help="替身服务使用的 Chromium 路径")
+    parser.add_argument("--with-db", action="store_true", help="将读取结果写入 .env 配置的数据库并统计 db_insert")
+    parser.add_argument("--wait-policy", choices=("fixed", "condition"), default="condition", help="读取过程中的等待策略")
+    parser.add_argument("--min-dwell", type=float, default=1.5, help="条件等待时每一步的最短停留秒数")
+    parser.add_argument("--dwell-jitter", type=float, default=1.5, help="在最短停留上叠加的随机秒数上限")
+    parser.add_argument("--compare-wait", action="store_true", help="依次运行 fixed 和 condition 两种等待策略并对比")
+    parser.add_argument("--block-resources", action="store_true", help="轻量模式: 屏蔽图片、字体、广告和遥测请求")
+    parser.add_argument("--compare-blocking", action="store_true", help="依次运行普通模式和轻量模式并对比")
+    parser.add_argument("--json", help="将结果保存为 JSON 文件")
+    args = parser.parse_args()
+
+    if args.compare_wait:
+        result = compare_wait_policies(args)
+    elif args.compare_blocking:
+        result = compare_resource_blocking(args)
+    else:
+        result = run_benchmark(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-import requests
 import time
 import logging
 import random
@@ -7,6 +6,7 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
+from adspower_client import AdsPowerError, DEFAULT_API_URL, get_client
 
 # 配置日志
 logging.basicConfig(
@@ -20,7 +20,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # ADS Power API 配置
-ADSP_BASE_URL = "http://local.adspower.net:50325"  # 本地 ADS Power API 地址
+ADSP_BASE_URL = DEFAULT_API_URL  # 本地 ADS Power API 地址
 PROFILE_ID = "k11yvbja"  # 浏览器指纹配置文件ID
 PROXY_DETECTION = "0"  # 代理检测设置，0 表示关闭，1 表示开启，根据需要修改
 
@@ -31,56 +31,32 @@ OUTLOOK_PASSWORD = "p87o6gAU31j"  # 替换为你的 Outlook 密码
 def start_adspower_profile():
     """启动 ADS Power 指纹浏览器实例"""
     logger.info("正在启动 ADS Power 指纹浏览器实例")
-    url = f"{ADSP_BASE_URL}/api/v2/browser-profile/start"
-    payload = {
-        "profile_id": PROFILE_ID,
-        "proxy_detection": PROXY_DETECTION
-    }
-    headers = {"Content-Type": "application/json"}
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            if data["code"] == 0:
-                selenium_port = data["data"]["ws"]["selenium"]
-                logger.info(f"浏览器实例启动成功, Selenium 端口: {selenium_port}")
-                return selenium_port
-            else:
-                logger.error(f"启动浏览器失败: {data['msg']}")
-                raise Exception(f"启动浏览器失败: {data['msg']}")
-        else:
-            logger.error(f"API 请求失败: {response.text}")
-            raise Exception(f"API 请求失败: {response.text}")
-    except Exception as e:
+        data = get_client(ADSP_BASE_URL).start_profile(PROFILE_ID, proxy_detection=PROXY_DETECTION)
+        selenium_port = data["ws"]["selenium"]
+        logger.info(f"浏览器实例启动成功, Selenium 端口: {selenium_port}")
+        return selenium_port
+    except AdsPowerError as e:
         logger.error(f"启动浏览器时发生错误: {str(e)}")
         raise
 
 def stop_adspower_profile():
     """关闭 ADS Power 指纹浏览器实例"""
     logger.info("正在关闭 ADS Power 指纹浏览器实例")
-    url = f"{ADSP_BASE_URL}/api/v2/browser-profile/stop"
-    payload = {
-        "profile_id": PROFILE_ID
-    }
-    headers = {"Content-Type": "application/json"}
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            if data["code"] == 0:
-                logger.info("浏览器实例已关闭")
-            else:
-                logger.error(f"关闭浏览器失败: {data['msg']}")
-        else:
-            logger.error(f"API 请求失败: {response.text}")
-    except Exception as e:
+        get_client(ADSP_BASE_URL).stop_profile(PROFILE_ID)
+        logger.info("浏览器实例已关闭")
+    except AdsPowerError as e:
         logger.error(f"关闭浏览器时发生错误: {str(e)}")
 
 def login_outlook():
     """使用 Selenium 登录 Outlook 邮箱"""
+    driver = None
+    started = False
     try:
         # 获取 ADS Power 提供的 Selenium ip:port
         selenium_endpoint = start_adspower_profile()
+        started = True
 
         # 配置 Selenium WebDriver
         logger.info("正在配置 Selenium WebDriver")
@@ -211,15 +187,19 @@ def login_outlook():
         # WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, "Pivot29-Tab0")))
         logger.info("登录成功，已进入 Outlook 邮箱收件箱")
 
-        # 关闭浏览器
-        logger.info("正在关闭浏览器")
-        driver.quit()
-        stop_adspower_profile()
-
     except Exception as e:
         logger.error(f"登录过程中出错: {str(e)}")
-        driver.quit()
-        stop_adspower_profile()
+
+    finally:
+        # 关闭浏览器: WebDriver 创建失败时 driver 为 None, profile 启动失败时无需关闭
+        logger.info("正在关闭浏览器")
+        if driver:
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.error(f"退出 WebDriver 时出错: {str(e)}")
+        if started:
+            stop_adspower_profile()
 
 if __name__ == "__main__":
     logger.info("开始执行 Outlook 登录脚本")
@@ -1,21 +1,39 @@
 # -*- coding: utf-8 -*-
+import io
 import os
+import re
+import json
 import time
 import random
+import select
+import hashlib
+import itertools
+import socket
+import queue
 import logging
-import requests
+import threading
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from itertools import islice
+from contextlib import contextmanager
+from collections import OrderedDict, deque
 import psycopg2
-from psycopg2 import Error
+from psycopg2 import Error, errors, sql
 from psycopg2.extras import execute_values
 from psycopg2.pool import ThreadedConnectionPool
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException, TimeoutException, StaleElementReferenceException 
+from selenium.common.exceptions import (
+    NoSuchElementException, TimeoutException, StaleElementReferenceException, WebDriverException,
+    InvalidSessionIdException,
+)
+from adspower_client import AdsPowerError, AdsPowerUnavailableError, DEFAULT_API_URL, get_client
+import read_email_metrics
+import read_email_tracing
 
 
 # 配置日志
@@ -32,6 +50,302 @@ logger = logging.getLogger(__name__)
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
+# outlook_email_list 有邮箱需要检查时发送 NOTIFY 的频道
+NEED_CHECK_CHANNEL = "outlook_need_check"
+
+# iter_table 服务端游标名的序号, 同一连接上同时打开多个遍历时不会重名
+_named_cursor_ids = itertools.count()
+
+# ensure_schema 使用的 advisory lock 键
+SCHEMA_LOCK_KEY = 0x6f75746c
+
+OUTLOOK_INBOX_URL = "https://outlook.live.com"
+
+# 分区表维护(预建分区、清理过期分区)的间隔秒数
+PARTITION_MAINTENANCE_INTERVAL = 3600
+
+# 需要检查的邮箱: 与部分索引 idx_outlook_email_list_need_check 的谓词保持一致
+NEED_CHECK_QUERY = '''
+    SELECT
+        address, ads_browser_id
+    FROM
+        outlook_email_list
+    WHERE
+        is_valid = TRUE
+        AND is_login = TRUE
+        AND is_need_check > 0;
+'''
+
+CLAIM_NEED_CHECK_QUERY = '''
+    WITH picked AS (
+        SELECT
+            id
+        FROM
+            outlook_email_list
+        WHERE
+            is_valid = TRUE
+            AND is_login = TRUE
+            AND is_need_check > 0
+            AND (claim_expire_time IS NULL OR claim_expire_time < NOW())
+            AND (next_retry_time IS NULL OR next_retry_time <= NOW())
+        ORDER BY
+            need_check_time NULLS FIRST, id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE
+        outlook_email_list AS l
+    SET
+        claimed_by = %s,
+        claim_expire_time = NOW() + make_interval(secs => %s)
+    FROM
+        picked
+    WHERE
+        l.id = picked.id
+    RETURNING
+        l.address, l.ads_browser_id;
+'''
+
+# 按 ads_browser_id 哈希分片领取: 参数依次为 分片数, 分片序号, limit, worker_id, 租约秒数
+SHARDED_CLAIM_NEED_CHECK_QUERY = CLAIM_NEED_CHECK_QUERY.replace(
+    "        ORDER BY",
+    "            AND (hashtext(ads_browser_id) & 2147483647) %% %s = %s\n        ORDER BY",
+    1
+)
+
+# 单个 profile 连续失败时的退避: 第 n 次失败后等待 min(BASE * 2^(n-1), MAX) 秒才会被重新领取,
+# 连续失败 FAILURE_THRESHOLD 次后将 is_valid 置为 FALSE 并在 remark 中记录原因
+FAILURE_BACKOFF_BASE = 300
+FAILURE_BACKOFF_MAX = 6 * 3600
+FAILURE_THRESHOLD = 8
+# 基础设施故障(状态 unavailable)与 profile 本身无关, 不计入 fail_count, 只推迟固定秒数后重试
+INFRASTRUCTURE_RETRY_DELAY = 300
+
+# 与具体 profile 无关的错误: AdsPower 不可用(连接失败、超时、重试耗尽)、Selenium 连接断开、数据库连接;
+# AdsPower 返回的业务错误(profile 被占用、代理失败等)是 AdsPowerError, 计入该 profile 的连续失败
+INFRASTRUCTURE_ERRORS = (
+    AdsPowerUnavailableError, ConnectionError, Urllib3HTTPError, InvalidSessionIdException,
+    psycopg2.OperationalError, psycopg2.InterfaceError,
+)
+
+# 回写检查结果的 SET 子句, v 为 (address, status, worker_id, checked_at, error); 同步和异步版本共用
+# status: success, no_mail, error(计入该 profile 的连续失败), unavailable(基础设施故障, 不计入)
+CHECK_RESULT_ASSIGNMENTS = f'''
+        is_need_check = CASE WHEN v.status IN ('error', 'unavailable') THEN l.is_need_check ELSE 0 END,
+        need_check_time = to_timestamp(v.checked_at)::timestamp,
+        last_check_status = v.status,
+        fail_count = CASE v.status WHEN 'error' THEN l.fail_count + 1 WHEN 'unavailable' THEN l.fail_count ELSE 0 END,
+        next_retry_time = CASE v.status
+            WHEN 'error' THEN to_timestamp(v.checked_at)::timestamp + make_interval(
+                secs => LEAST({FAILURE_BACKOFF_MAX}, {FAILURE_BACKOFF_BASE} * power(2, LEAST(l.fail_count, 30))))
+            WHEN 'unavailable' THEN to_timestamp(v.checked_at)::timestamp
+                + make_interval(secs => {INFRASTRUCTURE_RETRY_DELAY})
+        END,
+        last_error = CASE WHEN v.status IN ('error', 'unavailable') THEN v.error END,
+        is_valid = CASE WHEN v.status = 'error' AND l.fail_count + 1 >= {FAILURE_THRESHOLD}
+            THEN FALSE ELSE l.is_valid END,
+        remark = CASE WHEN v.status = 'error' AND l.is_valid AND l.fail_count + 1 >= {FAILURE_THRESHOLD}
+            THEN concat_ws('; ', l.remark, '连续失败 ' || (l.fail_count + 1) || ' 次, 已停用: ' || COALESCE(v.error, '未知错误'))
+            ELSE l.remark END,
+        claimed_by = NULL,
+        claim_expire_time = NULL
+'''
+
+
+# 按 (email_address, content_hash) 去重写入邮件; {source} 为行来源, 同步版本用 (VALUES %s), 异步版本用 unnest
+# NOT EXISTS 同时适用于分区表(无法建唯一索引), ON CONFLICT 兜底并发插入
+INSERT_EMAIL_CONTENT_QUERY = '''
+    INSERT INTO outlook_email_content (email_address, email_title, email_content, content_hash)
+    SELECT
+        v.email_address, v.email_title, v.email_content, v.content_hash
+    FROM
+        {source} AS v (email_address, email_title, email_content, content_hash)
+    WHERE
+        NOT EXISTS (
+            SELECT 1 FROM outlook_email_content AS c
+            WHERE c.email_address = v.email_address AND c.content_hash = v.content_hash
+        )
+    ON CONFLICT DO NOTHING
+    RETURNING id;
+'''
+
+UPSERT_SYNC_CURSOR_QUERY = '''
+    INSERT INTO outlook_sync_cursor (email_address, last_message_key, last_subject, update_time)
+    VALUES (%s, %s, %s, NOW())
+    ON CONFLICT (email_address) DO UPDATE SET
+        last_message_key = EXCLUDED.last_message_key,
+        last_subject = EXCLUDED.last_subject,
+        update_time = EXCLUDED.update_time;
+'''
+
+RELEASE_EXPIRED_CLAIMS_QUERY = '''
+    UPDATE
+        outlook_email_list
+    SET
+        claimed_by = NULL,
+        claim_expire_time = NULL
+    WHERE
+        claim_expire_time < NOW();
+'''
+
+
+def is_infrastructure_error(error):
+    """错误是否来自基础设施(见 INFRASTRUCTURE_ERRORS), 这类失败不计入 profile 的连续失败次数"""
+    return isinstance(error, INFRASTRUCTURE_ERRORS)
+
+
+LATEST_EMAIL_CONTENT_QUERY = '''
+    SELECT
+        id, create_time, email_title
+    FROM
+        outlook_email_content
+    WHERE
+        email_address = %s
+    ORDER BY
+        create_time DESC
+    LIMIT %s;
+'''
+
+# 随表一起创建的索引: 表名 -> [(索引名, DDL)]
+MANAGED_INDEXES = {
+    "outlook_email_list": [
+        ("idx_outlook_email_list_need_check", '''
+            CREATE INDEX IF NOT EXISTS idx_outlook_email_list_need_check
+                ON outlook_email_list (need_check_time NULLS FIRST, id)
+                WHERE is_valid = TRUE AND is_login = TRUE AND is_need_check > 0;
+        '''),
+        ("idx_outlook_email_list_claim_expire", '''
+            CREATE INDEX IF NOT EXISTS idx_outlook_email_list_claim_expire
+                ON outlook_email_list (claim_expire_time)
+                WHERE claim_expire_time IS NOT NULL;
+        '''),
+    ],
+    "outlook_email_content": [
+        ("idx_outlook_email_content_address_time", '''
+            CREATE INDEX IF NOT EXISTS idx_outlook_email_content_address_time
+                ON outlook_email_content (email_address, create_time);
+        '''),
+    ],
+}
+
+# 一次 execute_script 完成邮件列表读取、广告识别、发件人和标题提取, 替代逐封邮件多次 find_elements
+INBOX_LISTING_SCRIPT = """
+return Array.from(document.querySelectorAll("[role='option']")).map(function (el, index) {
+    var label = el.querySelector('.m9Rge');
+    var senderEl = el.querySelector('.ESO13 span');
+    var subjectEl = el.querySelector('span[title]');
+    var sender = senderEl ? senderEl.innerText.trim() : '';
+    var adReason = '';
+    if (label && label.innerText.trim().toLowerCase() === 'ad') {
+        adReason = 'ad_label';
+    } else if (el.querySelector("img[src*='ads-olk-icon.png']")) {
+        adReason = 'ad_icon';
+    } else if (sender.toLowerCase().indexOf('microsoft outlook') !== -1) {
+        adReason = 'sender';
+    }
+    return {
+        index: index,
+        conversation_id: el.getAttribute('data-convid') || el.id || '',
+        aria_label: el.getAttribute('aria-label') || '',
+        sender: sender,
+        subject: subjectEl ? subjectEl.innerText.trim() : '',
+        is_ad: adReason !== '',
+        ad_reason: adReason,
+        subject_element: subjectEl
+    };
+});
+"""
+
+
+def _iter_chunks(iterable, chunk_size):
+    """
+    将任意可迭代对象切分为最多 chunk_size 条的列表块
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _copy_text_value(value):
+    """
+    将单个字段转义为 COPY text 格式
+    """
+    if value is None:
+        return r'\N'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def _read_meminfo():
+    """
+    读取 /proc/meminfo, 返回 {字段名: KB}, 非 Linux 系统返回空字典
+    """
+    meminfo = {}
+    try:
+        with open('/proc/meminfo', encoding='utf-8') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                meminfo[name] = int(value.split()[0])
+    except (OSError, ValueError, IndexError):
+        return {}
+    return meminfo
+
+
+def host_memory_used_mb():
+    """
+    主机已用内存(MemTotal - MemAvailable), 单位 MB, 无法获取时返回 None
+    """
+    meminfo = _read_meminfo()
+    if 'MemTotal' not in meminfo or 'MemAvailable' not in meminfo:
+        return None
+    return (meminfo['MemTotal'] - meminfo['MemAvailable']) / 1024
+
+
+def host_memory_available_mb():
+    """
+    主机可用内存(MemAvailable), 单位 MB, 无法获取时返回 None
+    """
+    meminfo = _read_meminfo()
+    if 'MemAvailable' not in meminfo:
+        return None
+    return meminfo['MemAvailable'] / 1024
+
+
+def content_hash(email_title, email_content):
+    """
+    邮件内容哈希: 标题和正文折叠空白、转小写后计算 sha256, 用于同一邮箱下的去重
+    """
+    normalized = "\x1f".join(
+        re.sub(r'\s+', ' ', value or '').strip().lower() for value in (email_title, email_content)
+    )
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def _hashed_rows(email_data):
+    """
+    转换为 (email_address, email_title, email_content, content_hash) 并去掉批内重复, 返回 (rows, 输入条数)
+    """
+    rows = {}
+    total = 0
+    for data in email_data:
+        total += 1
+        digest = content_hash(data['email_title'], data['email_content'])
+        rows.setdefault((data['email_address'], digest),
+                        (data['email_address'], data['email_title'], data['email_content'], digest))
+    return list(rows.values()), total
+
+
+def _add_months(month_start, months):
+    """月初日期加减若干个月"""
+    index = month_start.year * 12 + month_start.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
 
 class PostgresDBManager:
     """
@@ -72,24 +386,184 @@ class PostgresDBManager:
                 self.connection.close()
             logger.debug("数据库连接已关闭或归还到连接池")
 
-    def create_email_content_table(self):
-        """创建 outlook_email_content 表"""
+    def create_email_content_table(self, partitioned=False, months_ahead=3):
+        """
+        创建 outlook_email_content 表
+        partitioned=True 时创建按 create_time 月度分区的表(只对新建的表生效), 并预建当前及之后 months_ahead 个月的分区,
+        过期数据通过 enforce_content_retention 整个分区脱离/删除, 不需要逐行 DELETE
+        """
         try:
-            create_table_query = '''
-                CREATE TABLE IF NOT EXISTS outlook_email_content (
-                    id SERIAL PRIMARY KEY,
-                    create_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    email_address VARCHAR(255) NOT NULL,
-                    email_title VARCHAR(255),
-                    email_content TEXT
-                );
-            '''
+            if partitioned:
+                create_table_query = '''
+                    CREATE TABLE IF NOT EXISTS outlook_email_content (
+                        id BIGSERIAL,
+                        create_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        email_address VARCHAR(255) NOT NULL,
+                        email_title VARCHAR(255),
+                        email_content TEXT,
+                        content_hash CHAR(64),
+                        PRIMARY KEY (id, create_time)
+                    ) PARTITION BY RANGE (create_time);
+                '''
+            else:
+                create_table_query = '''
+                    CREATE TABLE IF NOT EXISTS outlook_email_content (
+                        id SERIAL PRIMARY KEY,
+                        create_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        email_address VARCHAR(255) NOT NULL,
+                        email_title VARCHAR(255),
+                        email_content TEXT,
+                        content_hash CHAR(64)
+                    );
+                '''
             self.cursor.execute(create_table_query)
+            # 兼容已存在的旧表, 补齐内容哈希列
+            self.cursor.execute(
+                "ALTER TABLE outlook_email_content ADD COLUMN IF NOT EXISTS content_hash CHAR(64);"
+            )
             self.connection.commit()
             logger.info("表 outlook_email_content 创建成功")
         except (Exception, Error) as error:
             logger.error("创建 outlook_email_content 表时出错: %s", error)
             raise
+        if self.is_content_partitioned():
+            self.ensure_content_partitions(months_ahead)
+        self.create_content_hash_index()
+        self.create_indexes("outlook_email_content")
+
+    def is_content_partitioned(self):
+        """outlook_email_content 是否为分区表"""
+        try:
+            self.cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('outlook_email_content');")
+            row = self.cursor.fetchone()
+            self.connection.commit()
+            return bool(row) and row[0] == 'p'
+        except (Exception, Error) as error:
+            logger.error("查询 outlook_email_content 表类型时出错: %s", error)
+            self.connection.rollback()
+            return False
+
+    def ensure_content_partitions(self, months_ahead=3):
+        """
+        预建当前月及之后 months_ahead 个月的分区, 以及兜底的 default 分区, 返回新建的分区名
+        """
+        created = []
+        this_month = date.today().replace(day=1)
+        try:
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outlook_email_content_default
+                    PARTITION OF outlook_email_content DEFAULT;
+            ''')
+            self.connection.commit()
+        except (Exception, Error) as error:
+            logger.error("创建 outlook_email_content 默认分区时出错: %s", error)
+            self.connection.rollback()
+            raise
+        for offset in range(months_ahead + 1):
+            start = _add_months(this_month, offset)
+            end = _add_months(start, 1)
+            name = f"outlook_email_content_p{start:%Y%m}"
+            try:
+                self.cursor.execute("SELECT to_regclass(%s);", (name,))
+                if self.cursor.fetchone()[0]:
+                    continue
+                self.cursor.execute(
+                    f"CREATE TABLE {name} PARTITION OF outlook_email_content "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}');"
+                )
+                self.connection.commit()
+                created.append(name)
+                logger.info("分区 %s 创建成功: [%s, %s)", name, start, end)
+            except (Exception, Error) as error:
+                # 默认分区中已有该月数据时无法直接创建, 需要人工迁移
+                logger.error("创建分区 %s 时出错: %s", name, error)
+                self.connection.rollback()
+        return created
+
+    def enforce_content_retention(self, retention_months, drop=True):
+        """
+        保留最近 retention_months 个月(含当月)的分区, 更早的分区整体 DETACH, drop=True 时随后 DROP
+        返回处理过的分区名
+        """
+        cutoff = _add_months(date.today().replace(day=1), -(retention_months - 1))
+        expired = []
+        try:
+            self.cursor.execute('''
+                SELECT
+                    child.relname
+                FROM
+                    pg_inherits
+                    JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                WHERE
+                    pg_inherits.inhparent = to_regclass('outlook_email_content');
+            ''')
+            for (name,) in self.cursor.fetchall():
+                match = re.fullmatch(r'outlook_email_content_p(\d{4})(\d{2})', name)
+                if match and date(int(match.group(1)), int(match.group(2)), 1) < cutoff:
+                    expired.append(name)
+            self.connection.commit()
+            for name in sorted(expired):
+                self.cursor.execute(f"ALTER TABLE outlook_email_content DETACH PARTITION {name};")
+                if drop:
+                    self.cursor.execute(f"DROP TABLE {name};")
+                self.connection.commit()
+                logger.info("过期分区 %s 已%s", name, "删除" if drop else "脱离")
+        except (Exception, Error) as error:
+            logger.error("清理 outlook_email_content 过期分区时出错: %s", error)
+            self.connection.rollback()
+            raise
+        return sorted(expired)
+
+    def maintain_content_partitions(self, months_ahead=3, retention_months=None):
+        """
+        分区表的定期维护: 预建后续分区, 设置了 retention_months 时清理过期分区; 非分区表直接跳过
+        """
+        if not self.is_content_partitioned():
+            return
+        self.ensure_content_partitions(months_ahead)
+        if retention_months:
+            self.enforce_content_retention(retention_months)
+
+    def create_content_hash_index(self):
+        """
+        创建 (email_address, content_hash) 唯一索引; 旧表中已有重复数据时创建失败, 需要先执行 dedup_email_content
+        分区表的唯一索引必须包含分区键, 因此分区表上创建普通索引, 去重依靠插入时的 NOT EXISTS 检查
+        """
+        if self.is_content_partitioned():
+            index_query = '''
+                CREATE INDEX IF NOT EXISTS idx_outlook_email_content_address_hash
+                    ON outlook_email_content (email_address, content_hash);
+            '''
+        else:
+            index_query = '''
+                CREATE UNIQUE INDEX IF NOT EXISTS uq_outlook_email_content_address_hash
+                    ON outlook_email_content (email_address, content_hash);
+            '''
+        try:
+            self.cursor.execute(index_query)
+            self.connection.commit()
+            logger.info("outlook_email_content 索引 (email_address, content_hash) 创建成功")
+            return True
+        except (Exception, Error) as error:
+            logger.warning("创建 outlook_email_content 唯一索引失败, 请先执行 dedup_email_content 去重: %s", error)
+            self.connection.rollback()
+            return False
+
+    def ensure_schema(self):
+        """
+        幂等地创建或补齐主循环依赖的表、列、索引和 NOTIFY 触发器, 已有的旧库也能直接运行 main_loop
+        多个进程同时启动时通过 advisory lock 串行执行, 避免并发替换触发器函数时出错
+        """
+        self.cursor.execute("SELECT pg_advisory_lock(%s);", (SCHEMA_LOCK_KEY,))
+        self.connection.commit()
+        try:
+            self.create_email_list_table()
+            self.create_email_content_table()
+            self.create_sync_cursor_table()
+        finally:
+            self.connection.rollback()
+            self.cursor.execute("SELECT pg_advisory_unlock(%s);", (SCHEMA_LOCK_KEY,))
+            self.connection.commit()
 
     def create_email_list_table(self):
         """创建 outlook_email_list 表"""
@@ -110,48 +584,367 @@ class PostgresDBManager:
                     is_need_check INTEGER DEFAULT 0,
                     need_check_time TIMESTAMP,
                     stop_time TIMESTAMP,
-                    remark TEXT
+                    remark TEXT,
+                    claimed_by VARCHAR(255),
+                    claim_expire_time TIMESTAMP,
+                    last_check_status VARCHAR(32),
+                    fail_count INTEGER NOT NULL DEFAULT 0,
+                    next_retry_time TIMESTAMP,
+                    last_error TEXT
                 );
             '''
             self.cursor.execute(create_table_query)
+            # 兼容已存在的旧表, 补齐领取队列、检查结果和失败退避所需的列
+            self.cursor.execute('''
+                ALTER TABLE outlook_email_list
+                    ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(255),
+                    ADD COLUMN IF NOT EXISTS claim_expire_time TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS last_check_status VARCHAR(32),
+                    ADD COLUMN IF NOT EXISTS fail_count INTEGER NOT NULL DEFAULT 0,
+                    ADD COLUMN IF NOT EXISTS next_retry_time TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS last_error TEXT;
+            ''')
             self.connection.commit()
             logger.info("表 outlook_email_list 创建成功")
         except (Exception, Error) as error:
             logger.error("创建 outlook_email_list 表时出错: %s", error)
             raise
+        self.create_need_check_notify_trigger()
+        self.create_indexes("outlook_email_list")
 
-    def insert_email_content(self, email_data):
-        """批量插入邮件数据到 outlook_email_content 表"""
+    def create_indexes(self, table_name=None):
+        """
+        创建 MANAGED_INDEXES 中登记的索引, table_name 为空时创建全部
+        need_check 部分索引覆盖领取/查询的过滤条件并按 need_check_time 排序;
+        update_is_need_check 按 address 更新, 使用 address 的 UNIQUE 索引即可
+        """
+        for table, indexes in MANAGED_INDEXES.items():
+            if table_name and table != table_name:
+                continue
+            for index_name, ddl in indexes:
+                try:
+                    self.cursor.execute(ddl)
+                    self.connection.commit()
+                    logger.info("索引 %s 创建成功", index_name)
+                except (Exception, Error) as error:
+                    logger.error("创建索引 %s 时出错: %s", index_name, error)
+                    self.connection.rollback()
+                    raise
+
+    def explain_need_check_plan(self, force_index=False):
+        """
+        用 EXPLAIN 检查热点查询是否使用了 MANAGED_INDEXES 中的索引, 返回 {查询名: 检查结果}
+        表中数据很少时规划器会选择顺序扫描, force_index=True 时在事务内关闭 enable_seqscan,
+        用于确认索引至少可以被使用
+        """
+        checks = [
+            ("claim_need_check", CLAIM_NEED_CHECK_QUERY, (1, "explain", 1), "idx_outlook_email_list_need_check"),
+            ("query_need_check", NEED_CHECK_QUERY, None, "idx_outlook_email_list_need_check"),
+            ("latest_email_content", LATEST_EMAIL_CONTENT_QUERY, ("explain@outlook.com", 1),
+             "idx_outlook_email_content_address_time"),
+        ]
+
+        def walk(plan):
+            yield plan
+            for child in plan.get("Plans", []):
+                yield from walk(child)
+
+        results = {}
         try:
-            insert_query = '''
-                INSERT INTO outlook_email_content (email_address, email_title, email_content)
-                VALUES %s;
+            if force_index:
+                self.cursor.execute("SET LOCAL enable_seqscan = off;")
+            for name, query, params, expected_index in checks:
+                self.cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                plan = self.cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                nodes = list(walk(plan[0]["Plan"]))
+                indexes = sorted({node["Index Name"] for node in nodes if "Index Name" in node})
+                seq_scans = sorted({node["Relation Name"] for node in nodes if node["Node Type"] == "Seq Scan"})
+                uses_index = expected_index in indexes
+                results[name] = {
+                    "uses_index": uses_index,
+                    "expected_index": expected_index,
+                    "indexes": indexes,
+                    "seq_scans": seq_scans,
+                    "total_cost": plan[0]["Plan"]["Total Cost"],
+                }
+                if uses_index:
+                    logger.info("查询 %s 使用索引 %s", name, expected_index)
+                else:
+                    logger.warning("查询 %s 未使用索引 %s, 实际索引 %s, 顺序扫描 %s",
+                                   name, expected_index, indexes, seq_scans)
+        except (Exception, Error) as error:
+            logger.error("EXPLAIN 检查索引时出错: %s", error)
+            raise
+        finally:
+            self.connection.rollback()
+        return results
+
+    def create_need_check_notify_trigger(self):
+        """
+        在 outlook_email_list 上创建触发器, is_need_check 或 need_check_time 变化且需要检查时
+        通过 pg_notify 通知监听者, payload 为邮箱地址
+        回写检查结果(last_check_status、fail_count 或 next_retry_time 变化)时不通知, 避免读取失败的邮箱被立即重新领取
+        """
+        try:
+            create_trigger_query = f'''
+                CREATE OR REPLACE FUNCTION notify_outlook_need_check() RETURNS trigger AS $$
+                BEGIN
+                    IF NEW.is_need_check > 0 AND (
+                        TG_OP = 'INSERT'
+                        OR (
+                            NEW.last_check_status IS NOT DISTINCT FROM OLD.last_check_status
+                            AND NEW.fail_count IS NOT DISTINCT FROM OLD.fail_count
+                            AND NEW.next_retry_time IS NOT DISTINCT FROM OLD.next_retry_time
+                            AND (
+                                NEW.is_need_check IS DISTINCT FROM OLD.is_need_check
+                                OR NEW.need_check_time IS DISTINCT FROM OLD.need_check_time
+                            )
+                        )
+                    ) THEN
+                        PERFORM pg_notify('{NEED_CHECK_CHANNEL}', NEW.address);
+                    END IF;
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                DROP TRIGGER IF EXISTS trg_outlook_need_check_notify ON outlook_email_list;
+                CREATE TRIGGER trg_outlook_need_check_notify
+                    AFTER INSERT OR UPDATE OF is_need_check, need_check_time ON outlook_email_list
+                    FOR EACH ROW EXECUTE FUNCTION notify_outlook_need_check();
+            '''
+            self.cursor.execute(create_trigger_query)
+            self.connection.commit()
+            logger.info("outlook_email_list 的 NOTIFY 触发器创建成功")
+        except (Exception, Error) as error:
+            logger.error("创建 outlook_email_list NOTIFY 触发器时出错: %s", error)
+            self.connection.rollback()
+            raise
+
+    def create_sync_cursor_table(self):
+        """创建 outlook_sync_cursor 表, 记录每个账号已读取到的最新邮件"""
+        try:
+            create_table_query = '''
+                CREATE TABLE IF NOT EXISTS outlook_sync_cursor (
+                    email_address VARCHAR(255) PRIMARY KEY,
+                    last_message_key VARCHAR(255) NOT NULL,
+                    last_subject VARCHAR(255),
+                    update_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
             '''
-            values = [(data['email_address'], data['email_title'], data['email_content']) for data in email_data]
-            execute_values(self.cursor, insert_query, values)
+            self.cursor.execute(create_table_query)
+            self.connection.commit()
+            logger.info("表 outlook_sync_cursor 创建成功")
+        except (Exception, Error) as error:
+            logger.error("创建 outlook_sync_cursor 表时出错: %s", error)
+            self.connection.rollback()
+            raise
+
+    def get_sync_cursor(self, email_address):
+        """
+        查询账号的同步游标, 返回最后读取的邮件标识, 没有记录时返回 None
+        """
+        try:
+            self.cursor.execute(
+                "SELECT last_message_key FROM outlook_sync_cursor WHERE email_address = %s;",
+                (email_address,)
+            )
+            row = self.cursor.fetchone()
+            self.connection.commit()
+            return row[0] if row else None
+        except (Exception, Error) as error:
+            logger.error("查询邮箱 %s 的同步游标时出错: %s", email_address, error)
+            self.connection.rollback()
+            return None
+
+    def update_sync_cursor(self, email_address, message_key, subject=None):
+        """
+        更新账号的同步游标为最后读取的邮件
+        """
+        try:
+            self.cursor.execute(UPSERT_SYNC_CURSOR_QUERY, (email_address, message_key, (subject or '')[:255]))
             self.connection.commit()
-            logger.info("向 outlook_email_content 表插入 %d 条数据成功", len(values))
+            logger.info("邮箱 %s 的同步游标已更新为 %s", email_address, message_key)
+        except (Exception, Error) as error:
+            logger.error("更新邮箱 %s 的同步游标时出错: %s", email_address, error)
+            self.connection.rollback()
+            raise
+
+    def insert_email_content(self, email_data):
+        """
+        批量插入邮件数据到 outlook_email_content 表, 按 (email_address, content_hash) 去重
+        返回 {"inserted": 新写入条数, "duplicates": 重复跳过条数}
+        """
+        try:
+            insert_query = INSERT_EMAIL_CONTENT_QUERY.format(source="(VALUES %s)")
+            values, total = _hashed_rows(email_data)
+            inserted = len(execute_values(self.cursor, insert_query, values,
+                                          template="(%s, %s, %s, %s::bpchar)", fetch=True))
+            self.connection.commit()
+            logger.info("向 outlook_email_content 表插入 %d 条数据成功, 重复跳过 %d 条", inserted, total - inserted)
+            return {"inserted": inserted, "duplicates": total - inserted}
         except (Exception, Error) as error:
             logger.error("插入 outlook_email_content 数据时出错: %s", error)
             self.connection.rollback()
             raise
 
+    def copy_email_content(self, email_iter, chunk_size=5000, use_copy=True):
+        """
+        流式批量写入 outlook_email_content 表, 用于回填或重放大批量邮件
+        email_iter 可以是任意可迭代的邮件字典, 按 chunk_size 分块通过 COPY FROM STDIN 写入临时表,
+        再以 ON CONFLICT DO NOTHING 合并到正式表并逐块提交; COPY 失败时回滚当前块, 之后的数据回退到 execute_values 写入
+        返回 {"inserted": 新写入条数, "duplicates": 重复跳过条数}
+        """
+        stage_query = '''
+            CREATE TEMP TABLE IF NOT EXISTS outlook_email_content_stage (
+                email_address VARCHAR(255),
+                email_title VARCHAR(255),
+                email_content TEXT,
+                content_hash CHAR(64)
+            ) ON COMMIT DELETE ROWS;
+        '''
+        copy_query = '''
+            COPY outlook_email_content_stage (email_address, email_title, email_content, content_hash)
+            FROM STDIN WITH (FORMAT text)
+        '''
+        merge_query = '''
+            INSERT INTO outlook_email_content (email_address, email_title, email_content, content_hash)
+            SELECT s.email_address, s.email_title, s.email_content, s.content_hash
+            FROM outlook_email_content_stage AS s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM outlook_email_content AS c
+                WHERE c.email_address = s.email_address AND c.content_hash = s.content_hash
+            )
+            ON CONFLICT DO NOTHING;
+        '''
+        total = 0
+        inserted = 0
+        start = time.perf_counter()
+        for chunk in _iter_chunks(email_iter, chunk_size):
+            if use_copy:
+                rows, chunk_total = _hashed_rows(chunk)
+                buffer = io.StringIO()
+                for row in rows:
+                    buffer.write('\t'.join(_copy_text_value(value) for value in row) + '\n')
+                buffer.seek(0)
+                try:
+                    self.cursor.execute(stage_query)
+                    self.cursor.copy_expert(copy_query, buffer)
+                    self.cursor.execute(merge_query)
+                    chunk_inserted = self.cursor.rowcount
+                    self.connection.commit()
+                    total += chunk_total
+                    inserted += chunk_inserted
+                    logger.debug("COPY 写入 %d 条数据, 新增 %d 条, 累计 %d 条", chunk_total, chunk_inserted, total)
+                    continue
+                except (Exception, Error) as error:
+                    logger.warning("COPY 写入 outlook_email_content 失败, 回退到 execute_values: %s", error)
+                    self.connection.rollback()
+                    use_copy = False
+            result = self.insert_email_content(chunk)
+            total += result["inserted"] + result["duplicates"]
+            inserted += result["inserted"]
+
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed > 0 else 0.0
+        logger.info("批量写入 outlook_email_content 共 %d 条, 新增 %d 条, 重复 %d 条, 耗时 %.2f 秒, %.0f 行/秒",
+                    total, inserted, total - inserted, elapsed, rate)
+        return {"inserted": inserted, "duplicates": total - inserted}
+
+    def dedup_email_content(self, batch_size=5000):
+        """
+        一次性回填 content_hash 并清理 outlook_email_content 的历史重复数据, 完成后创建唯一索引
+        1. 按 id 分批计算并写入缺失的 content_hash
+        2. 同一 (email_address, content_hash) 只保留 id 最小的一条: 先一次性把需要删除的 id 写入临时表,
+           再按批从临时表取 id 删除, 只扫描一遍整张表
+        返回 {"hashed": 回填条数, "deleted": 删除条数}
+        """
+        hashed = 0
+        deleted = 0
+        try:
+            self.cursor.execute(
+                "ALTER TABLE outlook_email_content ADD COLUMN IF NOT EXISTS content_hash CHAR(64);"
+            )
+            # 回填期间先去掉唯一索引, 避免回填出的重复值冲突; 插入使用 ON CONFLICT DO NOTHING, 不依赖索引存在
+            self.cursor.execute("DROP INDEX IF EXISTS uq_outlook_email_content_address_hash;")
+            self.connection.commit()
+
+            last_id = 0
+            while True:
+                self.cursor.execute('''
+                    SELECT id, email_title, email_content
+                    FROM outlook_email_content
+                    WHERE content_hash IS NULL AND id > %s
+                    ORDER BY id
+                    LIMIT %s;
+                ''', (last_id, batch_size))
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+                execute_values(self.cursor, '''
+                    UPDATE outlook_email_content AS c
+                    SET content_hash = v.content_hash
+                    FROM (VALUES %s) AS v (id, content_hash)
+                    WHERE c.id = v.id;
+                ''', [(row[0], content_hash(row[1], row[2])) for row in rows])
+                self.connection.commit()
+                last_id = rows[-1][0]
+                hashed += len(rows)
+                logger.info("已回填 %d 条 content_hash", hashed)
+
+            # 临时表只在当前连接可见, 分批提交时保留, 结束后删除
+            self.cursor.execute("DROP TABLE IF EXISTS pg_temp.outlook_email_content_dup_ids;")
+            self.cursor.execute('''
+                CREATE TEMP TABLE outlook_email_content_dup_ids AS
+                SELECT id FROM (
+                    SELECT
+                        id,
+                        ROW_NUMBER() OVER (PARTITION BY email_address, content_hash ORDER BY id) AS rn
+                    FROM outlook_email_content
+                ) AS ranked
+                WHERE rn > 1;
+            ''')
+            duplicates = self.cursor.rowcount
+            self.cursor.execute("CREATE INDEX ON outlook_email_content_dup_ids (id);")
+            self.connection.commit()
+            logger.info("找到 %d 条重复邮件", duplicates)
+
+            for _ in range(0, duplicates, batch_size):
+                self.cursor.execute('''
+                    WITH batch AS (
+                        DELETE FROM outlook_email_content_dup_ids
+                        WHERE id IN (SELECT id FROM outlook_email_content_dup_ids ORDER BY id LIMIT %s)
+                        RETURNING id
+                    )
+                    DELETE FROM outlook_email_content AS c
+                    USING batch
+                    WHERE c.id = batch.id;
+                ''', (batch_size,))
+                deleted += self.cursor.rowcount
+                self.connection.commit()
+                logger.info("已删除 %d 条重复邮件", deleted)
+        except (Exception, Error) as error:
+            logger.error("outlook_email_content 去重时出错: %s", error)
+            self.connection.rollback()
+            raise
+        finally:
+            try:
+                self.cursor.execute("DROP TABLE IF EXISTS pg_temp.outlook_email_content_dup_ids;")
+                self.connection.commit()
+            except (Exception, Error) as error:
+                logger.warning("删除去重临时表时出错: %s", error)
+                self.connection.rollback()
+        self.create_content_hash_index()
+        logger.info("outlook_email_content 去重完成, 回填 %d 条, 删除 %d 条", hashed, deleted)
+        return {"hashed": hashed, "deleted": deleted}
+
     def query_need_check_emails(self):
         """
         查询 is_valid=TRUE, is_login=TRUE, is_need_check>0 的邮箱记录
         """
         try:
-            query = '''
-                SELECT
-                    address, ads_browser_id
-                FROM
-                    outlook_email_list
-                WHERE
-                    is_valid = TRUE
-                    AND is_login = TRUE
-                    AND is_need_check > 0;
-            '''
-            self.cursor.execute(query)
+            self.cursor.execute(NEED_CHECK_QUERY)
             rows = self.cursor.fetchall()
             logger.info("查询到 %d 条符合条件的邮箱记录", len(rows))
             for row in rows:
@@ -161,32 +954,196 @@ class PostgresDBManager:
             logger.error("查询 outlook_email_list 表时出错: %s", error)
             return []
 
-    def query_table(self, table_name):
+    def claim_need_check_batch(self, limit, worker_id, lease_seconds=1800, shard=None):
         """
-        查询指定表的所有数据
+        原子领取一批需要检查的邮箱, 多个进程/主机可同时调用而不会重复领取
+        使用 FOR UPDATE SKIP LOCKED 跳过其他事务正在领取的行, 并写入 claimed_by 和租约到期时间,
+        租约过期(领取者崩溃或超时)的行会重新进入队列
+        shard 为 (分片序号, 分片数) 时只领取 hashtext(ads_browser_id) 落在该分片的邮箱
         """
         try:
-            query = f'SELECT * FROM {table_name};'
-            self.cursor.execute(query)
+            if shard:
+                shard_index, shard_count = shard
+                self.cursor.execute(SHARDED_CLAIM_NEED_CHECK_QUERY,
+                                    (shard_count, shard_index, limit, worker_id, lease_seconds))
+            else:
+                self.cursor.execute(CLAIM_NEED_CHECK_QUERY, (limit, worker_id, lease_seconds))
             rows = self.cursor.fetchall()
-            logger.info("从 %s 表查询到 %d 条记录", table_name, len(rows))
-            for row in rows:
-                logger.debug("%s 表记录: %s", table_name, row)
-            return rows
-        except (Exception, Error) as error:
-            logger.error("查询 %s 表时出错: %s", table_name, error)
+            self.connection.commit()
+            logger.info("%s 领取到 %d 条需要检查的邮箱记录, 租约 %d 秒", worker_id, len(rows), lease_seconds)
+            return [{"address": row[0], "ads_browser_id": row[1]} for row in rows]
+        except (errors.UndefinedTable, errors.UndefinedColumn) as error:
+            # 表结构不完整时不能当作没有待处理邮箱, 否则主循环会一直空转
+            logger.error("outlook_email_list 表结构不完整, 请先执行 ensure_schema: %s", error)
+            self.connection.rollback()
             raise
+        except (Exception, Error) as error:
+            logger.error("领取 outlook_email_list 记录时出错: %s", error)
+            self.connection.rollback()
+            return []
+
+    def release_claim(self, email_address, worker_id):
+        """
+        释放当前 worker 对指定邮箱的领取, 使其在下一轮可以被重新领取
+        """
+        try:
+            release_query = '''
+                UPDATE
+                    outlook_email_list
+                SET
+                    claimed_by = NULL,
+                    claim_expire_time = NULL
+                WHERE
+                    address = %s
+                    AND claimed_by = %s;
+            '''
+            self.cursor.execute(release_query, (email_address, worker_id))
+            self.connection.commit()
+            logger.info("已释放邮箱 %s 的领取", email_address)
+        except (Exception, Error) as error:
+            logger.error("释放邮箱 %s 的领取时出错: %s", email_address, error)
+            self.connection.rollback()
+
+    def query_unclaimed_profiles(self, ads_browser_ids):
+        """
+        在给定的 profile 中筛出属于 outlook_email_list 且当前没有被任何 worker 领取(或租约已过期)的, 返回集合
+        """
+        try:
+            query = '''
+                SELECT
+                    ads_browser_id
+                FROM
+                    outlook_email_list
+                WHERE
+                    ads_browser_id = ANY(%s)
+                    AND (claimed_by IS NULL OR claim_expire_time < NOW());
+            '''
+            self.cursor.execute(query, (list(ads_browser_ids),))
+            rows = self.cursor.fetchall()
+            self.connection.commit()
+            return {row[0] for row in rows}
+        except (Exception, Error) as error:
+            logger.error("查询未领取的 profile 时出错: %s", error)
+            self.connection.rollback()
+            return set()
+
+    def release_expired_claims(self):
+        """
+        清理已过期的租约, 返回被放回队列的记录数
+        """
+        try:
+            self.cursor.execute(RELEASE_EXPIRED_CLAIMS_QUERY)
+            count = self.cursor.rowcount
+            self.connection.commit()
+            if count:
+                logger.warning("%d 条邮箱记录的租约已过期, 重新放回队列", count)
+            return count
+        except (Exception, Error) as error:
+            logger.error("清理过期租约时出错: %s", error)
+            self.connection.rollback()
+            return 0
+
+    def iter_table(self, table_name, columns=None, filters=None, page_size=1000, key_column="id",
+                   named_cursor=False):
+        """
+        流式遍历表数据, 逐行 yield, 内存占用与表大小无关
+        默认按 key_column 做 keyset 分页(WHERE key > 上一页最后的 key ORDER BY key LIMIT page_size), 每页单独提交,
+        key_column 可以是任意可排序的唯一列;
+        named_cursor=True 时使用服务端游标, 每次从服务器取 page_size 行, 适用于没有唯一键的表;
+        调用方提前停止遍历时关闭游标并结束事务
+        columns: 查询的列名列表, 默认全部; filters: {列名: 值} 等值过滤, 值为 None 时匹配 IS NULL
+        出错时回滚并重新抛出异常, 调用方不会拿到被截断却看似完整的结果
+        """
+        projection = (sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+                      if columns else sql.SQL('*'))
+        table = sql.Identifier(table_name)
+        conditions = []
+        params = []
+        for column, value in (filters or {}).items():
+            if value is None:
+                conditions.append(sql.SQL('{} IS NULL').format(sql.Identifier(column)))
+            else:
+                conditions.append(sql.SQL('{} = %s').format(sql.Identifier(column)))
+                params.append(value)
+
+        def where(prefix=' WHERE '):
+            return sql.SQL(prefix) + sql.SQL(' AND ').join(conditions) if conditions else sql.SQL('')
+
+        if named_cursor:
+            query = sql.SQL('SELECT {} FROM {}{}').format(projection, table, where())
+            cursor = self.connection.cursor(name=f"iter_{table_name}_{next(_named_cursor_ids)}")
+            failed = False
+            try:
+                cursor.itersize = page_size
+                cursor.execute(query, params)
+                for row in cursor:
+                    yield row
+            except (Exception, Error) as error:
+                failed = True
+                logger.error("遍历 %s 表时出错: %s", table_name, error)
+                raise
+            finally:
+                # 正常结束、出错或调用方提前停止(GeneratorExit)时都关闭游标, 不让事务一直打开
+                try:
+                    cursor.close()
+                except (Exception, Error):
+                    failed = True
+                if failed:
+                    self.connection.rollback()
+                else:
+                    self.connection.commit()
+            return
+
+        # keyset 分页: 第一列固定为 key_column, 返回时去掉; 每页取完即提交, yield 期间不持有事务
+        key = sql.Identifier(key_column)
+        first_page = sql.SQL('SELECT {key}, {projection} FROM {table}{where} ORDER BY {key} LIMIT %s').format(
+            key=key, projection=projection, table=table, where=where(),
+        )
+        next_page = sql.SQL('SELECT {key}, {projection} FROM {table} WHERE {key} > %s{extra} ORDER BY {key} LIMIT %s').format(
+            key=key, projection=projection, table=table, extra=where(' AND '),
+        )
+        last_key = None
+        while True:
+            try:
+                if last_key is None:
+                    self.cursor.execute(first_page, params + [page_size])
+                else:
+                    self.cursor.execute(next_page, [last_key] + params + [page_size])
+                rows = self.cursor.fetchall()
+                self.connection.commit()
+            except (Exception, Error) as error:
+                logger.error("遍历 %s 表时出错: %s", table_name, error)
+                self.connection.rollback()
+                raise
+            for row in rows:
+                yield row[1:]
+            if len(rows) < page_size:
+                return
+            last_key = rows[-1][0]
+
+    def query_table(self, table_name, columns=None, filters=None):
+        """
+        查询指定表的所有数据并返回列表; 大表请直接使用 iter_table 流式遍历
+        """
+        rows = list(self.iter_table(table_name, columns=columns, filters=filters, named_cursor=True))
+        logger.info("从 %s 表查询到 %d 条记录", table_name, len(rows))
+        return rows
 
     def update_is_need_check(self, email_address):
         """
-        将指定邮箱的 is_need_check 置为 0
+        将指定邮箱的 is_need_check 置为 0, 并清除连续失败记录
         """
         try:
             update_query = '''
                 UPDATE
                     outlook_email_list
                 SET
-                    is_need_check = 0
+                    is_need_check = 0,
+                    fail_count = 0,
+                    next_retry_time = NULL,
+                    last_error = NULL,
+                    claimed_by = NULL,
+                    claim_expire_time = NULL
                 WHERE
                     address = %s;
             '''
@@ -199,217 +1156,1154 @@ class PostgresDBManager:
             raise
         return True
 
+    def apply_check_results(self, results):
+        """
+        用一条 UPDATE ... FROM (VALUES ...) 批量回写检查结果
+        results: [(address, status, worker_id, checked_at, error)], status 为 success/no_mail/error/unavailable,
+        checked_at 为 time.time(), error 为失败原因(可为 None)
+        success 和 no_mail 将 is_need_check 置为 0 并清除连续失败记录; error 累加 fail_count, 按指数退避设置
+        next_retry_time, 达到 FAILURE_THRESHOLD 时停用该邮箱; unavailable(基础设施故障)不改变 fail_count,
+        只推迟 INFRASTRUCTURE_RETRY_DELAY 秒. 所有结果都会写入 need_check_time 和
+        last_check_status, 并释放该 worker 的领取. 返回更新的行数
+        """
+        if not results:
+            return 0
+        try:
+            update_query = f'''
+                UPDATE
+                    outlook_email_list AS l
+                SET {CHECK_RESULT_ASSIGNMENTS}
+                FROM
+                    (VALUES %s) AS v(address, status, worker_id, checked_at, error)
+                WHERE
+                    l.address = v.address
+                    AND (v.status NOT IN ('error', 'unavailable') OR l.claimed_by IS NULL OR l.claimed_by = v.worker_id);
+            '''
+            execute_values(self.cursor, update_query, results, template="(%s, %s, %s, %s::float8, %s::text)",
+                           page_size=len(results))
+            count = self.cursor.rowcount
+            self.connection.commit()
+            logger.info("批量回写 %d 个邮箱的检查结果, 更新 %d 行", len(results), count)
+            return count
+        except (Exception, Error) as error:
+            logger.error("批量回写检查结果时出错: %s", error)
+            self.connection.rollback()
+            raise
+
+
+class NeedCheckListener:
+    """
+    监听 outlook_email_list 的 NOTIFY, 有邮箱被标记为需要检查时唤醒主循环
+    使用独立的 autocommit 连接, 不占用连接池; 连接断开时退化为定时等待, 下次调用时重连
+    """
+    def __init__(self, channel=NEED_CHECK_CHANNEL, debounce=0.5):
+        """
+        debounce: 收到第一条通知后再等待的秒数, 用于合并短时间内的一批通知
+        """
+        self.channel = channel
+        self.debounce = debounce
+        self.connection = None
+
+    def connect(self):
+        """建立监听连接并执行 LISTEN"""
+        self.connection = psycopg2.connect(
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            database=os.getenv("DB_NAME")
+        )
+        self.connection.set_session(autocommit=True)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel};")
+        logger.info("开始监听 NOTIFY 频道 %s", self.channel)
+
+    def close(self):
+        """关闭监听连接"""
+        if self.connection:
+            try:
+                self.connection.close()
+            except (Exception, Error):
+                pass
+            self.connection = None
+
+    def _drain(self):
+        """读取并清空已到达的通知, 返回通知的邮箱地址列表"""
+        self.connection.poll()
+        addresses = [notify.payload for notify in self.connection.notifies]
+        self.connection.notifies.clear()
+        return addresses
+
+    def wait(self, timeout):
+        """
+        最多等待 timeout 秒, 收到通知返回 True, 超时返回 False
+        """
+        try:
+            if self.connection is None:
+                self.connect()
+            addresses = self._drain()
+            if not addresses:
+                readable, _, _ = select.select([self.connection], [], [], timeout)
+                if not readable:
+                    return False
+                if self.debounce:
+                    time.sleep(self.debounce)
+                addresses = self._drain()
+            if addresses:
+                logger.info("收到 %d 条需要检查的通知: %s", len(addresses), addresses[:5])
+            return bool(addresses)
+        except (Exception, Error) as error:
+            logger.error("监听 NOTIFY 时出错, 退化为定时轮询: %s", error)
+            self.close()
+            time.sleep(timeout)
+            return False
+
+
+def message_key(item):
+    """
+    收件箱列表中一封邮件的标识: 优先使用 conversation id, 否则使用发件人、标题和 aria-label 的哈希
+    """
+    if item.get('conversation_id'):
+        return f"conv:{item['conversation_id']}"
+    raw = "\x1f".join((item.get('sender', ''), item.get('subject', ''), item.get('aria_label', '')))
+    return "hash:" + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class FetchResult(list):
+    """
+    fetch_outlook_emails 的返回值: 读取到的邮件列表, 附带本次读取的状态
+    status: success 读取到新邮件, no_mail 列表加载正常但没有需要读取的新邮件, error 读取失败
+    error: 读取失败的原因, 随检查结果写入 last_error
+    infrastructure: 失败是否由基础设施(AdsPower、Selenium 连接等)引起, 见 is_infrastructure_error
+    """
+    def __init__(self, emails=(), status="error"):
+        super().__init__(emails)
+        self.status = status
+        self.error = None
+        self.infrastructure = False
+
+
+class AdsPowerSession:
+    """
+    单个 AdsPower 指纹浏览器会话, 持有自己的 WebDriver 和 profile 的启动/关闭
+    每个 profile 一个实例, 不在线程之间共享
+    可作为上下文管理器使用: 退出时总是退出 WebDriver 并关闭 profile, 已交还给热会话缓存(pooled)且没有异常时除外
+    """
+    def __init__(self, fetcher, ads_browser_id):
+        """
+        fetcher: 提供 AdsPower API 调用的 OutlookEmailFetcher
+        """
+        self.fetcher = fetcher
+        self.ads_browser_id = ads_browser_id
+        self.driver = None
+        self.started = False
+        self.pooled = False
+        self.timings = {}
+        self.listing = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None or not self.pooled:
+            with self.phase("teardown"):
+                self.close()
+        return False
+
+    @contextmanager
+    def phase(self, name):
+        """记录一个阶段的耗时(秒), 同名阶段累加"""
+        start = time.perf_counter()
+        try:
+            with read_email_tracing.span(name):
+                yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+            read_email_metrics.observe_stage(name, seconds)
+
+    def pop_timings(self):
+        """取出并清空已记录的阶段耗时"""
+        timings, self.timings = self.timings, {}
+        return timings
+
+    def start(self):
+        """启动 AdsPower profile 并挂载 Selenium, 挂载失败时关闭 profile 后抛出异常"""
+        # 启动前登记, 孤儿 profile 清理不会误关正在启动的 profile
+        self.fetcher.track_session(self)
+        try:
+            with self.phase("adspower_start"):
+                selenium_address = self.fetcher.start_adspower_profile(self.ads_browser_id)
+            self.started = True
+            self.attach(selenium_address)
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def attach(self, selenium_address):
+        """
+        挂载到已启动的浏览器; 由调用方自行启动的 profile 不会在 close 时被关闭
+        """
+        with self.phase("chrome_attach"):
+            chrome_options = Options()
+            chrome_options.add_experimental_option("debuggerAddress", selenium_address)
+            self.driver = webdriver.Chrome(options=chrome_options)
+            self.driver.maximize_window()
+            if self.fetcher.block_resources:
+                self.block_resources(self.fetcher.blocked_url_patterns)
+        return self
+
+    def block_resources(self, patterns):
+        """
+        通过 CDP Network.setBlockedURLs 屏蔽匹配的请求, 只对当前标签页生效; 失败时按普通模式继续读取
+        """
+        try:
+            self.driver.execute_cdp_cmd("Network.enable", {})
+            self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(patterns)})
+            logger.debug("浏览器 %s 已屏蔽 %d 类资源请求", self.ads_browser_id, len(patterns))
+        except Exception as e:
+            logger.warning("浏览器 %s 屏蔽资源请求失败, 按普通模式读取: %s", self.ads_browser_id, e)
+
+    def close(self):
+        """
+        退出 WebDriver 并关闭 AdsPower profile, 可重复调用
+        quit 失败时直接停止 chromedriver 进程, 避免遗留; 无论 quit 是否成功都会关闭 profile
+        """
+        self.pooled = False
+        try:
+            if self.driver:
+                try:
+                    self.driver.quit()
+                except Exception as e:
+                    logger.error("退出浏览器 %s 的 WebDriver 时出错: %s", self.ads_browser_id, e)
+                    try:
+                        self.driver.service.stop()
+                    except Exception as e:
+                        logger.error("停止浏览器 %s 的 chromedriver 时出错: %s", self.ads_browser_id, e)
+                self.driver = None
+        finally:
+            try:
+                if self.started:
+                    with self.phase("adspower_stop"):
+                        self.fetcher.stop_adspower_profile(self.ads_browser_id)
+                    self.started = False
+            finally:
+                self.fetcher.untrack_session(self)
+
+
+class WarmSessionCache:
+    """
+    按 ads_browser_id 缓存最近使用过的浏览器会话, 频繁检查的账号刷新收件箱即可, 无需重新启动 Chrome
+    缓存只保存空闲会话: 超过 max_sessions 按 LRU 淘汰, 空闲超过 idle_ttl 秒关闭,
+    主机已用内存超过 memory_ceiling_mb 时从最久未用的会话开始关闭
+    """
+    def __init__(self, fetcher, max_sessions=5, idle_ttl=600, memory_ceiling_mb=None):
+        self.fetcher = fetcher
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.memory_ceiling_mb = memory_ceiling_mb
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        logger.info("启用热会话缓存, 上限 %d, 空闲 %d 秒过期, 内存上限 %s MB",
+                    max_sessions, idle_ttl, memory_ceiling_mb)
+
+    def acquire(self, ads_browser_id):
+        """
+        取出指定 profile 的会话, 返回 (session, 是否复用的热会话); 没有可用的热会话时新启动一个
+        """
+        with self.lock:
+            entry = self.sessions.pop(ads_browser_id, None)
+        if entry:
+            session, _ = entry
+            session.pooled = False
+            try:
+                # 访问 current_url 确认浏览器仍然可用
+                session.driver.current_url
+                logger.info("复用浏览器 %s 的热会话", ads_browser_id)
+                return session, True
+            except Exception as e:
+                logger.warning("浏览器 %s 的热会话已失效, 重新启动: %s", ads_browser_id, e)
+                session.close()
+        return self.fetcher.open_session(ads_browser_id), False
+
+    def release(self, session):
+        """读取完成后将会话放回缓存, 并按容量/空闲时间/内存淘汰"""
+        session.pooled = True
+        with self.lock:
+            self.sessions[session.ads_browser_id] = (session, time.monotonic())
+            self.sessions.move_to_end(session.ads_browser_id)
+        self.evict()
+
+    def discard(self, session):
+        """会话读取出错或页面状态不可信时直接关闭, 不放回缓存"""
+        session.close()
+
+    def evict(self):
+        """按 LRU 上限、空闲时间和内存上限关闭多余的空闲会话"""
+        victims = []
+        now = time.monotonic()
+        with self.lock:
+            for ads_browser_id, (session, last_used) in list(self.sessions.items()):
+                if now - last_used > self.idle_ttl:
+                    victims.append(self.sessions.pop(ads_browser_id)[0])
+            while len(self.sessions) > self.max_sessions:
+                victims.append(self.sessions.popitem(last=False)[1][0])
+            if self.memory_ceiling_mb:
+                used_mb = host_memory_used_mb()
+                # 每关闭一个会话只能在下次调用时重新评估内存, 这里按需逐个淘汰
+                if used_mb is not None and used_mb > self.memory_ceiling_mb and self.sessions:
+                    victims.append(self.sessions.popitem(last=False)[1][0])
+                    logger.warning("主机已用内存 %.0f MB 超过上限 %d MB, 淘汰最久未用的热会话",
+                                   used_mb, self.memory_ceiling_mb)
+        for session in victims:
+            logger.info("关闭热会话 %s", session.ads_browser_id)
+            session.close()
+
+    def close_all(self):
+        """关闭所有缓存中的会话"""
+        with self.lock:
+            victims = [session for session, _ in self.sessions.values()]
+            self.sessions.clear()
+        for session in victims:
+            session.close()
+
+
+# 轻量读取模式下通过 CDP 屏蔽的请求: 图片、字体、广告和遥测
+# 广告识别只读取 img 的 src 属性, 不需要真正加载图片
+BLOCKED_URL_PATTERNS = (
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*OneCollector*", "*browser.events.data.microsoft.com*", "*.clarity.ms*", "*google-analytics.com*",
+    "*doubleclick.net*", "*adnxs.com*", "*amazon-adsystem.com*", "*adsdk*",
+)
+
+# 页面网络状态: 返回 readyState 和上次调用以来新增的资源请求数; 每次读取后清空资源计时缓冲区,
+# 否则缓冲区达到上限(Chrome 默认 250 条)后计数不再变化, 繁忙页面会被误判为空闲
+NETWORK_STATE_SCRIPT = """
+    var count = performance.getEntriesByType('resource').length;
+    performance.clearResourceTimings();
+    return [document.readyState, count];
+"""
+
+
+class WaitPolicy:
+    """
+    读取过程中的等待策略
+    fixed: 原有的固定随机等待, 导航后 4-8 秒, 打开邮件后 4-8 秒, 关闭前 4-10 秒
+    condition: 按页面条件等待, 导航后等邮件列表出现、打开邮件后等正文出现, 再等到页面加载完成且
+    network_idle 秒内没有新的资源请求; 每一步从开始计时至少停留 min_dwell + [0, dwell_jitter] 秒
+    """
+    FIXED_DWELLS = {"navigate": (4, 8), "open": (4, 8), "teardown": (4, 10)}
+
+    def __init__(self, mode="condition", min_dwell=1.5, dwell_jitter=1.5, network_idle=0.5,
+                 list_timeout=20, body_timeout=10, idle_timeout=10):
+        if mode not in ("fixed", "condition"):
+            raise ValueError(f"未知的等待策略: {mode}")
+        self.mode = mode
+        self.min_dwell = min_dwell
+        self.dwell_jitter = dwell_jitter
+        self.network_idle = network_idle
+        self.list_timeout = list_timeout
+        self.body_timeout = body_timeout
+        self.idle_timeout = idle_timeout
+
+    def _wait_network_idle(self, driver):
+        """等待 readyState 为 complete 且 network_idle 秒内没有新的资源请求, 最多 idle_timeout 秒"""
+        deadline = time.perf_counter() + self.idle_timeout
+        stable_since = None
+        while time.perf_counter() < deadline:
+            ready_state, count = driver.execute_script(NETWORK_STATE_SCRIPT)
+            now = time.perf_counter()
+            if ready_state != "complete" or count or stable_since is None:
+                stable_since = now
+            elif now - stable_since >= self.network_idle:
+                return True
+            time.sleep(0.1)
+        logger.debug("等待网络空闲超时(%d 秒)", self.idle_timeout)
+        return False
+
+    def dwell(self, driver, step, started):
+        """
+        step 为 navigate, open 或 teardown; started 为这一步开始时的 time.perf_counter()
+        """
+        if self.mode == "fixed":
+            wait_time = random.uniform(*self.FIXED_DWELLS[step])
+            logger.info(f"随机等待 {wait_time:.2f} 秒")
+            time.sleep(wait_time)
+            return
+        if step != "teardown":
+            try:
+                self._wait_network_idle(driver)
+            except WebDriverException as e:
+                # 页面脚本执行失败时退回固定等待, 不让一次轮询失败中断整个读取
+                wait_time = random.uniform(*self.FIXED_DWELLS[step])
+                logger.warning("检查网络空闲失败, 改为固定等待 %.2f 秒: %s", wait_time, e)
+                time.sleep(wait_time)
+                return
+        remaining = started + self.min_dwell + random.uniform(0, self.dwell_jitter) - time.perf_counter()
+        if remaining > 0:
+            logger.debug("最短停留, 再等待 %.2f 秒", remaining)
+            time.sleep(remaining)
+
+
+def _body_loaded(previous):
+    """
+    WebDriverWait 条件: 邮件正文出现, 且不是点击前已经显示的上一封邮件的正文
+    """
+    previous_element, previous_text = previous
+
+    def condition(driver):
+        elements = driver.find_elements(By.CSS_SELECTOR, "div[role='document']")
+        if not elements:
+            return False
+        element = elements[0]
+        if previous_element is None or element != previous_element:
+            return element
+        try:
+            return element if element.text != previous_text else False
+        except StaleElementReferenceException:
+            return False
+
+    return condition
+
 
 class OutlookEmailFetcher:
     """
     outlook邮件读取模块
     """
-    def __init__(self, adspower_api_url="http://local.adspower.net:50325"):
+    def __init__(self, adspower_api_url=DEFAULT_API_URL, inbox_url=OUTLOOK_INBOX_URL, wait_policy=None,
+                 block_resources=False, blocked_url_patterns=BLOCKED_URL_PATTERNS):
         """
-        初始化 AdsPower API 地址
+        初始化 AdsPower API 地址, 同一地址的 API 调用共享一个连接池客户端
+        inbox_url: 收件箱地址, 压测时可指向本地的收件箱夹具
+        wait_policy: 读取过程中的等待策略, 默认按页面条件等待(见 WaitPolicy)
+        block_resources: 轻量读取模式, 挂载浏览器后屏蔽 blocked_url_patterns 匹配的图片、字体、广告和遥测请求
         """
         self.adspower_api_url = adspower_api_url
-        logger.info("初始化 OutlookEmailFetcher, AdsPower API 地址: %s", adspower_api_url)
+        self.inbox_url = inbox_url
+        self.wait_policy = wait_policy or WaitPolicy()
+        self.block_resources = block_resources
+        self.blocked_url_patterns = blocked_url_patterns
+        self.live_sessions = {}
+        self.live_lock = threading.Lock()
+        self.client = get_client(adspower_api_url)
+        self.session_cache = None
+        self.phase_listeners = []
+        logger.info("初始化 OutlookEmailFetcher, AdsPower API 地址: %s, 收件箱地址: %s", adspower_api_url, inbox_url)
+
+    def add_phase_listener(self, listener):
+        """
+        注册阶段耗时回调, 每次读取结束后以 (email_address, ads_browser_id, timings) 调用
+        timings 为 {阶段名: 秒}, 阶段包括 adspower_start, chrome_attach, navigate, list_wait,
+        ad_filter, open_message, extract_body, dwell, teardown
+        """
+        self.phase_listeners.append(listener)
+
+    def report_phases(self, email_address, ads_browser_id, session):
+        """将本次读取的阶段耗时交给已注册的回调, 同步和异步的读取流程在会话结束后都应调用"""
+        timings = session.pop_timings()
+        logger.debug("邮箱 %s 各阶段耗时: %s", email_address,
+                     {name: round(seconds, 3) for name, seconds in timings.items()})
+        for listener in self.phase_listeners:
+            try:
+                listener(email_address, ads_browser_id, timings)
+            except Exception as e:
+                logger.error("阶段耗时回调出错: %s", e)
+
+    def track_session(self, session):
+        """登记正在使用的会话(包括热会话缓存中的空闲会话)"""
+        with self.live_lock:
+            self.live_sessions[session.ads_browser_id] = session
+
+    def untrack_session(self, session):
+        with self.live_lock:
+            if self.live_sessions.get(session.ads_browser_id) is session:
+                del self.live_sessions[session.ads_browser_id]
+
+    def tracked_profile_ids(self):
+        """当前进程持有的 profile"""
+        with self.live_lock:
+            return set(self.live_sessions)
+
+    def enable_warm_sessions(self, max_sessions=5, idle_ttl=600, memory_ceiling_mb=None):
+        """
+        启用热会话缓存, 读取完成后保留浏览器, 下次检查同一账号时直接刷新收件箱
+        """
+        self.session_cache = WarmSessionCache(self, max_sessions, idle_ttl, memory_ceiling_mb)
+        return self.session_cache
 
     def start_adspower_profile(self, ads_browser_id):
         """
-        启动 ADS Power 指纹浏览器实例
+        启动 ADS Power 指纹浏览器实例, 返回 Selenium 调试地址
         """
-        logger.info("正在启动 ADS Power 指纹浏览器实例")
-        start_url = f"{self.adspower_api_url}/api/v2/browser-profile/start"
-        start_payload = {
-            "profile_id": ads_browser_id,
-            "proxy_detection": "0"
-        }
+        logger.info("正在启动 ADS Power 指纹浏览器实例 %s", ads_browser_id)
         try:
-            logger.debug("发送启动浏览器请求: %s, 参数: %s", start_url, start_payload)
-            response = requests.post(start_url, json=start_payload)
-            if response.status_code == 200:
-                data = response.json()
-                if data["code"] == 0:
-                    logger.info("成功启动 AdsPower 浏览器 %s", ads_browser_id)
-                    chrome_options = Options()
-                    chrome_options.add_experimental_option("debuggerAddress", data["data"]["ws"]["selenium"])
-                    self.driver = webdriver.Chrome(options=chrome_options)
-                    self.driver.maximize_window()
-                else:
-                    logger.error("无法启动 AdsPower 浏览器 %s: %s", ads_browser_id, data["msg"])
-                    raise Exception(f"启动浏览器失败: {data['msg']}")
-            else:
-                logger.error(f"API 请求失败: {response.text}")
-                raise Exception(f"API 请求失败: {response.text}")
-        except Exception as e:
-            logger.error(f"启动浏览器时发生错误: {str(e)}")
+            data = self.client.start_profile(ads_browser_id)
+            logger.info("成功启动 AdsPower 浏览器 %s", ads_browser_id)
+            return data["ws"]["selenium"]
+        except AdsPowerError as e:
+            logger.error("无法启动 AdsPower 浏览器 %s: %s", ads_browser_id, e)
             raise
 
     def stop_adspower_profile(self, ads_browser_id):
         """
         关闭 ADS Power 指纹浏览器实例
         """
-        logger.info("正在关闭 ADS Power 指纹浏览器实例")
-        stop_url = f"{self.adspower_api_url}/api/v2/browser-profile/stop"
-        stop_payload = {
-            "profile_id": ads_browser_id
-        }
+        logger.info("正在关闭 ADS Power 指纹浏览器实例 %s", ads_browser_id)
         try:
-            logger.info("发送关闭ads浏览器请求: %s, %s", stop_url, stop_payload)
-            response = requests.post(stop_url, json=stop_payload)
-            if response.status_code == 200:
-                data = response.json()
-                if data["code"] == 0:
-                    logger.info("AdsPower 浏览器 %s 已关闭", ads_browser_id)
-                else:
-                    logger.error(f"关闭浏览器 {ads_browser_id} 失败: {data['msg']}")
-            else:
-                logger.error(f"API 请求失败: {response.text}")
-        except Exception as e:
-            logger.error(f"关闭浏览器时发生错误: {str(e)}")
+            self.client.stop_profile(ads_browser_id)
+            logger.info("AdsPower 浏览器 %s 已关闭", ads_browser_id)
+        except AdsPowerError as e:
+            logger.error("关闭浏览器 %s 失败: %s", ads_browser_id, e)
 
-    def fetch_outlook_emails(self, email_address, ads_browser_id):
+    def open_session(self, ads_browser_id):
         """
-        使用 AdsPower 和 Selenium 读取 Outlook 前 3 封非广告邮件
+        启动指定 profile 并返回独占的浏览器会话
         """
-        emails = []
+        return AdsPowerSession(self, ads_browser_id).start()
 
+    def _list_inbox(self, session, refresh=False):
+        """
+        读取收件箱列表, 返回每封邮件的 index, conversation_id, sender, subject, is_ad, ad_reason, subject_element
+        结果缓存在会话上, 页面导航后或 refresh=True 时重新读取
+        """
+        if session.listing is None or refresh:
+            listing = session.driver.execute_script(INBOX_LISTING_SCRIPT) or []
+            for item in listing:
+                item['message_key'] = message_key(item)
+            session.listing = listing
+        return session.listing
+
+    def _click_message(self, session, item):
+        """
+        点击邮件标题打开邮件, 缓存的元素失效时重新读取列表并按 conversation_id 定位
+        """
         try:
-            # 启动 AdsPower 指纹浏览器
-            self.start_adspower_profile(ads_browser_id)
-            
-            # 访问 Outlook 收件箱
-            logger.info("访问 Outlook 收件箱: %s", email_address)
-            self.driver.get("https://outlook.live.com")
+            item['subject_element'].click()
+        except StaleElementReferenceException:
+            logger.debug("邮件列表元素已失效, 重新读取列表")
+            listing = self._list_inbox(session, refresh=True)
+            for fresh in listing:
+                if fresh['message_key'] == item['message_key']:
+                    fresh['subject_element'].click()
+                    return
+            raise
 
-            wait_time = random.uniform(4, 8)
-            logger.info(f"随机等待 {wait_time:.2f} 秒")
-            time.sleep(wait_time)
-            
-            try:
-                # 等待邮件列表加载
-                logger.debug("等待邮件列表加载")
-                WebDriverWait(self.driver, 10).until(
+    @staticmethod
+    def _select_new_messages(non_ad_emails, since_key, max_messages):
+        """
+        按同步游标挑选需要读取的邮件, 返回从旧到新的列表, 最多 max_messages 封
+        列表中找到游标时读取游标之前(更新)的邮件; 首次同步或游标已不在列表中时读取最新的 max_messages 封
+        """
+        keys = [item['message_key'] for item in non_ad_emails]
+        if since_key and since_key in keys:
+            newer = non_ad_emails[:keys.index(since_key)]
+            return list(reversed(newer))[:max_messages]
+        return list(reversed(non_ad_emails[:max_messages]))
+
+    def read_inbox(self, session, email_address, since_key=None, max_messages=1, warm=False, emails=None):
+        """
+        在已挂载的会话中打开收件箱, 过滤广告并按同步游标读取新邮件, 返回 FetchResult
+        warm 为 True 时会话来自热会话缓存, 已停留在收件箱则直接刷新; 不负责启动和关闭浏览器
+        """
+        emails = FetchResult() if emails is None else emails
+        driver = session.driver
+
+        # 访问 Outlook 收件箱, 热会话已停留在收件箱时直接刷新
+        policy = self.wait_policy
+        navigated = time.perf_counter()
+        with session.phase("navigate"):
+            session.listing = None
+            if warm and driver.current_url.startswith(self.inbox_url):
+                logger.info("刷新 Outlook 收件箱: %s", email_address)
+                driver.refresh()
+            else:
+                logger.info("访问 Outlook 收件箱: %s", email_address)
+                driver.get(self.inbox_url)
+
+        try:
+            # 等待邮件列表加载
+            logger.debug("等待邮件列表加载")
+            with session.phase("list_wait"):
+                WebDriverWait(driver, policy.list_timeout).until(
                     EC.presence_of_element_located((By.CSS_SELECTOR, "[role='listbox'] [role='option']"))
                 )
-                logger.info("邮件列表加载成功")
-                
-                # 获取邮件列表，过滤广告邮件
-                email_elements = self.driver.find_elements(By.CSS_SELECTOR, "[role='option']")
-                logger.info("邮箱 %s 找到 %d 封邮件", email_address, len(email_elements))
-                non_ad_emails = []
-                for elem in email_elements:
-                    try:
-                        # 检查是否为广告邮件
-                        is_ad = False
-                        # 检查 'Ad' 标签
-                        ad_labels = elem.find_elements(By.CSS_SELECTOR, ".m9Rge")
-                        if ad_labels and ad_labels[0].text.strip().lower() == "ad":
-                            logger.debug("跳过广告邮件，包含 'Ad' 标签")
-                            is_ad = True
-                        # 检查广告图片
-                        ad_images = elem.find_elements(By.CSS_SELECTOR, "img[src*='ads-olk-icon.png']")
-                        if ad_images:
-                            logger.debug("跳过广告邮件，包含 ads-olk-icon.png")
-                            is_ad = True
-                        # 检查发件人（可选：排除常见广告发件人）
-                        sender = elem.find_elements(By.CSS_SELECTOR, ".ESO13 span")
-                        if sender and "microsoft outlook" in sender[0].text.lower():
-                            logger.debug("跳过广告邮件，发件人: %s", sender[0].text)
-                            is_ad = True
-                        if not is_ad:
-                            non_ad_emails.append(elem)
-                    except (NoSuchElementException, StaleElementReferenceException) as e:
-                        logger.debug("检查邮件广告标识时出错: %s", e)
-                        continue
-
-                logger.info("过滤后找到 %d 封非广告邮件，读取最新 1封", len(non_ad_emails))
-                
-                # 读取最新一封非广告邮件内容
-                for idx, email_elem in enumerate(non_ad_emails[:1]):
+            logger.info("邮件列表加载成功")
+            with session.phase("dwell"):
+                policy.dwell(driver, "navigate", navigated)
+
+            # 获取邮件列表，过滤广告邮件
+            with session.phase("ad_filter"):
+                listing = self._list_inbox(session)
+            logger.info("邮箱 %s 找到 %d 封邮件", email_address, len(listing))
+            non_ad_emails = []
+            for item in listing:
+                if item['is_ad']:
+                    logger.debug("跳过广告邮件(%s), 发件人: %s", item['ad_reason'], item['sender'])
+                else:
+                    non_ad_emails.append(item)
+
+            to_read = self._select_new_messages(non_ad_emails, since_key, max_messages)
+            logger.info("过滤后找到 %d 封非广告邮件, 其中 %d 封需要读取", len(non_ad_emails), len(to_read))
+            if not to_read:
+                emails.status = "no_mail"
+
+            # 从旧到新读取新邮件内容
+            for idx, item in enumerate(to_read):
+                try:
+                    logger.info("点击第 %d 封非广告邮件", idx + 1)
+                    # 获取邮件标题, 失败时停止读取, 避免游标越过未读取的邮件
+                    if item['subject_element'] is None:
+                        logger.error("无法提取第 %d 封邮件标题", idx + 1)
+                        break
+                    email_title = item['subject'] or "No title found"
+                    logger.info("提取邮件标题: %s", email_title)
+                    # 记下当前显示的正文, 连续读取多封时等待正文切换到新邮件
+                    shown = driver.find_elements(By.CSS_SELECTOR, "div[role='document']")
+                    previous = (shown[0], shown[0].text) if shown else (None, None)
+                    opened = time.perf_counter()
+                    with session.phase("open_message"):
+                        self._click_message(session, item)
+
+                    # 获取邮件内容: 等待正文切换到新邮件并读取文本, 之后再停留
                     try:
-                        logger.info("点击第 %d 封非广告邮件", idx + 1)
-                        # 获取邮件标题
-                        try:
-                            title = email_elem.find_element(By.CSS_SELECTOR, "span[title]")
-                            email_title = title.text
-                            logger.info("提取邮件标题: %s", email_title)
-                            title.click()
-                        except TimeoutException:
-                            logger.error("无法提取第 %d 封邮件标题", idx + 1)
-                            email_title = "No title found"
-                        
-                        wait_time = random.uniform(4, 8)
-                        logger.info(f"随机等待 {wait_time:.2f} 秒")
-                        time.sleep(wait_time)
-                        
-                        # 获取邮件内容
-                        try:
-                            content_elem = WebDriverWait(self.driver, 8).until(
-                                EC.presence_of_element_located((By.CSS_SELECTOR, "div[role='document']"))
-                            )
+                        with session.phase("extract_body"):
+                            content_elem = WebDriverWait(driver, policy.body_timeout).until(_body_loaded(previous))
                             email_content = content_elem.text.strip()
-                            logger.info("提取邮件内容: %s", email_content[:50] + "..." if len(email_content) > 50 else email_content)
-                        except TimeoutException:
-                            logger.error("无法提取第 %d 封邮件内容", idx + 1)
-                            email_content = "No content found"
-                        
-                        emails.append({
-                            "email_address": email_address,
-                            "email_title": email_title,
-                            "email_content": email_content
-                        })
-                        logger.info("成功读取第 %d 封非广告邮件", idx + 1)
-                        
-                    except (NoSuchElementException, TimeoutException, StaleElementReferenceException) as e:
-                        logger.error("无法读取第 %d 封非广告邮件: %s", idx + 1, e)
-                        continue
-                
-            except TimeoutException as e:
-                logger.error("无法加载 %s 的邮件列表: %s", email_address, e)
-
-            wait_time = random.uniform(4, 10)
-            logger.info(f"随机等待 {wait_time:.2f} 秒")
-            time.sleep(wait_time)
+                        with session.phase("dwell"):
+                            policy.dwell(driver, "open", opened)
+                        logger.info("提取邮件内容: %s", email_content[:50] + "..." if len(email_content) > 50 else email_content)
+                    except TimeoutException as e:
+                        # 正文未加载时停止读取, 不写入占位内容, 游标停在这封邮件之前, 下次重新读取
+                        logger.error("无法提取第 %d 封邮件内容, 停止读取", idx + 1)
+                        read_email_metrics.inc_error("extract_body", e)
+                        emails.error = f"extract_body {type(e).__name__}: {e}"
+                        break
+
+                    emails.append({
+                        "email_address": email_address,
+                        "email_title": email_title,
+                        "email_content": email_content,
+                        "message_key": item['message_key']
+                    })
+                    emails.status = "success"
+                    logger.info("成功读取第 %d 封非广告邮件", idx + 1)
+
+                except (NoSuchElementException, TimeoutException, StaleElementReferenceException) as e:
+                    logger.error("无法读取第 %d 封非广告邮件: %s", idx + 1, e)
+                    read_email_metrics.inc_error("open_message", e)
+                    emails.error = f"open_message {type(e).__name__}: {e}"
+                    break
+
+        except TimeoutException as e:
+            logger.error("无法加载 %s 的邮件列表: %s", email_address, e)
+            read_email_metrics.inc_error("list_wait", e)
+            emails.error = f"list_wait {type(e).__name__}: {e}"
+
+        with session.phase("dwell"):
+            policy.dwell(driver, "teardown", time.perf_counter())
+        return emails
+
+    def fetch_outlook_emails(self, email_address, ads_browser_id, since_key=None, max_messages=1):
+        """
+        使用 AdsPower 和 Selenium 增量读取 Outlook 非广告邮件
+        since_key 为上次读取到的邮件标识(同步游标), 只打开比它更新的邮件, 每次最多 max_messages 封, 从旧到新读取;
+        返回的每封邮件带 message_key, 最后一封即新的游标
+        每次调用使用独立的 AdsPowerSession, 可以在多个线程中并发调用; 出错时会话总会被关闭
+        """
+        emails = FetchResult()
+        session = None
+
+        try:
+            # 启动 AdsPower 指纹浏览器, 启用热会话缓存时优先复用
+            if self.session_cache:
+                session, warm = self.session_cache.acquire(ads_browser_id)
+            else:
+                session, warm = self.open_session(ads_browser_id), False
+            # 退出 with 时退出 WebDriver 并关闭 AdsPower 指纹浏览器, 已放回热会话缓存的除外
+            with session:
+                self.read_inbox(session, email_address, since_key, max_messages, warm, emails)
+                if self.session_cache:
+                    with session.phase("teardown"):
+                        # read_inbox 对列表加载失败、打开邮件失败只记录不抛出, 这类会话可能停留在错误页或已退出登录,
+                        # 只有干净读取完的会话才放回缓存
+                        if emails.status != "error" and emails.error is None:
+                            self.session_cache.release(session)
+                        else:
+                            logger.info("浏览器 %s 本次读取出错, 关闭会话而不放回热会话缓存", ads_browser_id)
+                            self.session_cache.discard(session)
 
-            # 清理
-            self.driver.quit()
-            # 关闭 AdsPower 指纹浏览器
-            self.stop_adspower_profile(ads_browser_id)
-            return emails
-        
         except Exception as e:
             logger.error("处理 AdsPower 浏览器 %s 时出错: %s", ads_browser_id, e)
-            self.stop_adspower_profile(ads_browser_id)
-            return emails
+            read_email_metrics.inc_error("fetch", e)
+            emails.error = f"fetch {type(e).__name__}: {e}"
+            emails.infrastructure = is_infrastructure_error(e)
+        finally:
+            if session:
+                self.report_phases(email_address, ads_browser_id, session)
+        return emails
 
 
-def process_email_task(email, downloader, connection_pool):
+class OrphanProfileReaper:
     """
-    处理单个邮箱账户, 读取邮件并存储到数据库
+    清理孤儿 profile: AdsPower 报告已打开, 但本进程没有持有对应会话、数据库中也没有被任何 worker 领取的 profile
+    (例如进程崩溃或关闭失败遗留的浏览器). 连续 grace_scans 次扫描都是孤儿才关闭, 避免误关刚启动的 profile;
+    只处理 outlook_email_list 中的 profile, 手动打开的其他 profile 不受影响.
+    同一主机上多个进程启用热会话缓存时, 其他进程缓存中的空闲会话也会被视为孤儿, 此时应只在一个进程中启用
     """
-    db_manager = PostgresDBManager(connection_pool=connection_pool)
-    try:
-        logger.info("处理邮箱: %s, AdsPower ID: %s", email['address'], email['ads_browser_id'])
-        emails = downloader.fetch_outlook_emails(email['address'], email['ads_browser_id'])
-        if emails:
-            logger.info("为 %s 读取到 %d 封邮件", email['address'], len(emails))
-            db_manager.insert_email_content(emails)
-            logger.info("更新邮箱 %s 的 is_need_check", email['address'])
-            db_manager.update_is_need_check(email['address'])
+    def __init__(self, fetcher, interval=300, grace_scans=2):
+        self.fetcher = fetcher
+        self.interval = interval
+        self.grace_scans = grace_scans
+        self.suspects = {}
+        self.last_scan = None
+
+    def scan(self, db_manager):
+        """距上次扫描超过 interval 秒时扫描一次, 返回本次关闭的 profile 数"""
+        now = time.monotonic()
+        if self.last_scan is not None and now - self.last_scan < self.interval:
+            return 0
+        self.last_scan = now
+        try:
+            active = self.fetcher.client.active_profiles()
+        except AdsPowerError as e:
+            logger.warning("查询已打开的 AdsPower profile 失败, 跳过本次孤儿清理: %s", e)
+            return 0
+        candidates = active - self.fetcher.tracked_profile_ids()
+        if candidates:
+            candidates = db_manager.query_unclaimed_profiles(candidates)
+        self.suspects = {profile_id: self.suspects.get(profile_id, 0) + 1 for profile_id in candidates}
+        orphans = [profile_id for profile_id, count in self.suspects.items() if count >= self.grace_scans]
+        for profile_id in orphans:
+            logger.warning("关闭孤儿 profile %s", profile_id)
+            self.fetcher.stop_adspower_profile(profile_id)
+            read_email_metrics.inc_error("reaper", "OrphanProfile")
+            del self.suspects[profile_id]
+        logger.info("孤儿 profile 扫描: 已打开 %d, 本进程持有 %d, 疑似孤儿 %d, 关闭 %d",
+                    len(active), len(self.fetcher.tracked_profile_ids()), len(self.suspects), len(orphans))
+        return len(orphans)
+
+
+class EmailWorkerPool:
+    """
+    常驻的邮箱处理线程池, 由有界队列供给任务
+    队列满时 submit 阻塞, 对领取端形成背压; 任一线程空闲即可处理下一个邮箱
+    """
+    def __init__(self, handler, worker_count=5, queue_size=None):
+        """
+        handler: 处理单个邮箱的函数
+        queue_size: 排队等待的最大任务数, 默认与线程数相同
+        """
+        self.handler = handler
+        self.worker_count = worker_count
+        self.limit = worker_count
+        self.tasks = queue.Queue(maxsize=queue_size or worker_count)
+        self.threads = []
+        self.active = 0
+        self.lock = threading.Lock()
+        self.permit = threading.Condition(self.lock)
+        self.slot_freed = threading.Event()
+
+    def start(self):
+        """启动所有工作线程"""
+        for i in range(self.worker_count):
+            thread = threading.Thread(target=self._run, name=f"email-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info("线程池已启动, 线程数 %d, 队列长度 %d", self.worker_count, self.tasks.maxsize)
+
+    def _run(self):
+        """
+        工作线程: 循环从队列取任务, 收到 None 时退出
+        检查并发上限和出队在同一把锁内完成: 上限被调低时超出上限的线程不会取任务,
+        任务留在队列中计入 queued_count, 不会出现已出队却未处理的任务
+        """
+        while True:
+            with self.permit:
+                while True:
+                    if self.active < self.limit:
+                        try:
+                            item = self.tasks.get_nowait()
+                            break
+                        except queue.Empty:
+                            pass
+                    self.permit.wait()
+                if item is not None:
+                    self.active += 1
+            if item is None:
+                self.tasks.task_done()
+                with self.permit:
+                    self.permit.notify()
+                return
+            try:
+                self.handler(item)
+            except Exception as e:
+                logger.error("并发任务出错: %s", e)
+            finally:
+                with self.permit:
+                    self.active -= 1
+                    self.permit.notify()
+                self.tasks.task_done()
+                self.slot_freed.set()
+
+    def active_count(self):
+        """正在处理的任务数"""
+        with self.lock:
+            return self.active
+
+    def queued_count(self):
+        """排队中的任务数"""
+        return self.tasks.qsize()
+
+    def free_slots(self):
+        """线程池还能接收的任务数(当前并发上限内的空闲线程 + 队列剩余空间)"""
+        with self.lock:
+            limit = self.limit
+        return limit + self.tasks.maxsize - self.active_count() - self.queued_count()
+
+    def set_limit(self, limit):
+        """调整同时处理的任务数上限, 范围 1 到线程数; 调低时正在处理的任务不受影响"""
+        with self.permit:
+            self.limit = max(1, min(self.worker_count, limit))
+            self.permit.notify_all()
+        self.slot_freed.set()
+
+    def submit(self, item, timeout=None):
+        """提交任务, 队列满时阻塞直到有空位"""
+        self.tasks.put(item, timeout=timeout)
+        with self.permit:
+            self.permit.notify()
+
+    def wait_for_slot(self, timeout):
+        """等待任一任务完成, 最多等待 timeout 秒"""
+        freed = self.slot_freed.wait(timeout)
+        self.slot_freed.clear()
+        return freed
+
+    def drain(self):
+        """取出所有尚未开始处理的任务并返回"""
+        pending = []
+        while True:
+            try:
+                item = self.tasks.get_nowait()
+            except queue.Empty:
+                return pending
+            self.tasks.task_done()
+            if item is not None:
+                pending.append(item)
+
+    def stop(self, timeout=None):
+        """
+        通知所有线程在完成当前任务后退出, 返回是否所有线程都已退出
+        空闲线程等待在 permit 上, 结束标记必须经 submit 放入队列并唤醒它们; 队列长度小于线程数时,
+        submit 会等到先前的结束标记被取走后再放入下一个
+        """
+        for _ in self.threads:
+            self.submit(None)
+        with self.permit:
+            self.permit.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+        alive = [thread.name for thread in self.threads if thread.is_alive()]
+        if alive:
+            logger.error("线程池停止超时, 仍在运行的线程: %s", ", ".join(alive))
+            return False
+        logger.info("线程池已停止")
+        return True
+
+
+class CheckStatusWriter:
+    """
+    检查结果的后写缓冲: 工作线程只把结果放入缓冲区, 后台线程在攒够 batch_size 条或距上次写入超过
+    flush_interval 秒时, 通过 apply_check_results 一次性写入, 代替每个邮箱一个 UPDATE 事务
+    同一邮箱只保留最新的结果; 写入失败时保留在缓冲区, 下次再试
+    """
+    def __init__(self, connection_pool, batch_size=100, flush_interval=2.0):
+        self.connection_pool = connection_pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """启动后台写入线程"""
+        self.thread = threading.Thread(target=self._run, name="check-status-writer", daemon=True)
+        self.thread.start()
+        logger.info("检查结果批量写入已启动, 每批 %d 条, 间隔 %.1f 秒", self.batch_size, self.flush_interval)
+
+    def record(self, email_address, status, worker_id=None, error=None):
+        """记录一个邮箱的检查结果, error 为失败原因"""
+        with self.lock:
+            self.pending.pop(email_address, None)
+            self.pending[email_address] = (email_address, status, worker_id, time.time(), error)
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def pending_count(self):
+        """尚未写入的结果数"""
+        with self.lock:
+            return len(self.pending)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """立即写入缓冲区中的结果, 返回写入的条数"""
+        with self.flush_lock:
+            with self.lock:
+                batch = list(self.pending.values())
+            if not batch:
+                return 0
+            db_manager = None
+            try:
+                db_manager = PostgresDBManager(connection_pool=self.connection_pool)
+                db_manager.apply_check_results(batch)
+            except Exception as e:
+                logger.error("写入 %d 条检查结果失败, 下次重试: %s", len(batch), e)
+                return 0
+            finally:
+                if db_manager:
+                    db_manager.close_connection()
+            with self.lock:
+                for address, status, worker_id, checked_at, error in batch:
+                    # 写入期间又有新结果的邮箱保留新结果
+                    if self.pending.get(address, (None, None, None, None, None))[3] == checked_at:
+                        del self.pending[address]
+            return len(batch)
+
+    def close(self):
+        """停止后台线程并写入剩余结果"""
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+        while self.pending_count() and self.flush():
+            pass
+        if self.pending_count():
+            logger.warning("%d 条检查结果未能写入, 对应的领取将在租约到期后释放", self.pending_count())
+
+
+class AdaptiveConcurrencyController:
+    """
+    根据主机资源压力调整 EmailWorkerPool 的并发上限, 范围 [min_workers, max_workers]
+    可用内存低于 min_free_mb、每核 1 分钟负载高于 max_load_per_cpu 或最近读取耗时 p95 超过 latency_p95
+    时减少一个并发(可用内存低于一半阈值时减半); 资源充足、p95 正常且线程池已满时增加一个并发
+    每次调整后至少等待 cooldown 秒再做下一次决策, 决策结果通过 snapshot 导出
+    """
+    def __init__(self, worker_pool, min_workers=1, max_workers=None, min_free_mb=1024, profile_mb=600,
+                 max_load_per_cpu=1.5, latency_p95=None, cooldown=60, window=50):
+        """
+        profile_mb: 每个浏览器大约占用的内存, 可用内存高于 min_free_mb + profile_mb 才会增加并发
+        latency_p95: 单次读取耗时 p95 的上限(秒), 默认不按耗时调整
+        window: 计算 p95 使用的最近读取次数
+        """
+        self.worker_pool = worker_pool
+        self.min_workers = min_workers
+        self.max_workers = max_workers or worker_pool.worker_count
+        self.min_free_mb = min_free_mb
+        self.profile_mb = profile_mb
+        self.max_load_per_cpu = max_load_per_cpu
+        self.latency_p95 = latency_p95
+        self.cooldown = cooldown
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.last_change = None
+        self.decisions = {"increase": 0, "decrease": 0, "hold": 0}
+        self.last_decision = ("hold", "初始")
+        self.inputs = {}
+        # 从下限开始逐步增加, 避免在小内存主机上一开始就启动过多浏览器
+        self.worker_pool.set_limit(self.min_workers)
+        logger.info("启用自适应并发, 范围 %d-%d, 可用内存下限 %d MB, 每核负载上限 %.1f, p95 上限 %s 秒",
+                    self.min_workers, self.max_workers, min_free_mb, max_load_per_cpu, latency_p95)
+
+    def observe(self, email_address, ads_browser_id, timings):
+        """作为 OutlookEmailFetcher 的阶段回调, 记录每次读取的总耗时"""
+        with self.lock:
+            self.latencies.append(sum(timings.values()))
+
+    def _p95(self):
+        with self.lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def _decide(self, limit, free_mb, load_per_cpu, p95):
+        """返回 (新的并发上限, 决策, 原因)"""
+        if free_mb is not None and free_mb < self.min_free_mb / 2:
+            return max(self.min_workers, limit // 2), "decrease", f"可用内存 {free_mb:.0f} MB 严重不足"
+        if free_mb is not None and free_mb < self.min_free_mb:
+            return max(self.min_workers, limit - 1), "decrease", f"可用内存 {free_mb:.0f} MB 不足"
+        if load_per_cpu is not None and load_per_cpu > self.max_load_per_cpu:
+            return max(self.min_workers, limit - 1), "decrease", f"每核负载 {load_per_cpu:.2f} 过高"
+        if self.latency_p95 and p95 is not None and p95 > self.latency_p95:
+            return max(self.min_workers, limit - 1), "decrease", f"读取耗时 p95 {p95:.1f} 秒过高"
+        if self.worker_pool.active_count() < limit:
+            return limit, "hold", "线程池未满"
+        if free_mb is not None and free_mb < self.min_free_mb + self.profile_mb:
+            return limit, "hold", f"可用内存 {free_mb:.0f} MB 不足以再启动一个浏览器"
+        if load_per_cpu is not None and load_per_cpu > self.max_load_per_cpu * 0.8:
+            return limit, "hold", f"每核负载 {load_per_cpu:.2f} 接近上限"
+        return min(self.max_workers, limit + 1), "increase", "资源充足且线程池已满"
+
+    def adjust(self):
+        """评估一次资源压力并调整并发上限, 返回当前上限; 由主循环定期调用"""
+        now = time.monotonic()
+        limit = self.worker_pool.limit
+        if self.last_change is not None and now - self.last_change < self.cooldown:
+            return limit
+        free_mb = host_memory_available_mb()
+        try:
+            load_per_cpu = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            load_per_cpu = None
+        p95 = self._p95()
+        new_limit, decision, reason = self._decide(limit, free_mb, load_per_cpu, p95)
+        if new_limit == limit:
+            decision = "hold"
+        self.inputs = {"free_mb": free_mb, "load_per_cpu": load_per_cpu, "latency_p95": p95}
+        self.decisions[decision] += 1
+        self.last_decision = (decision, reason)
+        read_email_metrics.record_concurrency_decision(decision)
+        if decision != "hold":
+            self.last_change = now
+            self.worker_pool.set_limit(new_limit)
+            logger.info("自适应并发: %d -> %d, %s", limit, new_limit, reason)
         else:
-            logger.warning("为 %s 未读取到邮件", email['address'])
-    except Exception as e:
-        logger.error("处理邮箱 %s 时出错: %s", email['address'], e)
-    finally:
-        db_manager.close_connection()
+            logger.debug("自适应并发保持 %d: %s", limit, reason)
+        return new_limit
+
+    def snapshot(self):
+        """当前并发上限、各类决策次数、最近一次决策和输入指标"""
+        return {
+            "limit": self.worker_pool.limit,
+            "min_workers": self.min_workers,
+            "max_workers": self.max_workers,
+            "decisions": dict(self.decisions),
+            "last_decision": self.last_decision[0],
+            "last_reason": self.last_decision[1],
+            **self.inputs,
+        }
+
+
+def default_worker_id():
+    """
+    生成当前进程的 worker 标识: 主机名-进程号
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def process_email_task(email, downloader, connection_pool, worker_id=None, max_messages=1, status_writer=None):
+    """
+    处理单个邮箱账户, 按同步游标增量读取新邮件并存储到数据库
+    指定 status_writer 时检查结果(success/no_mail/error/unavailable)交给它批量回写;
+    AdsPower、Selenium 连接或数据库连接等基础设施故障记为 unavailable, 不计入该 profile 的连续失败次数;
+    否则逐个更新 is_need_check, 处理失败时立即记录失败并释放领取, 退避时间过后再被重新领取
+    """
+    db_manager = PostgresDBManager(connection_pool=connection_pool)
+    status = "error"
+    error = None
+    with read_email_tracing.span("account_check", ads_browser_id=email['ads_browser_id'],
+                                 email_address=email['address'], worker_id=worker_id) as check_span:
+        try:
+            logger.info("处理邮箱: %s, AdsPower ID: %s", email['address'], email['ads_browser_id'])
+            with read_email_tracing.span("db_sync_cursor"):
+                since_key = db_manager.get_sync_cursor(email['address'])
+            emails = downloader.fetch_outlook_emails(email['address'], email['ads_browser_id'],
+                                                     since_key=since_key, max_messages=max_messages)
+            if emails:
+                logger.info("为 %s 读取到 %d 封邮件", email['address'], len(emails))
+                insert_start = time.perf_counter()
+                with read_email_tracing.span("db_insert", emails=len(emails)):
+                    result = db_manager.insert_email_content(emails)
+                    db_manager.update_sync_cursor(email['address'], emails[-1]['message_key'],
+                                                  emails[-1]['email_title'])
+                read_email_metrics.observe_stage("db_insert", time.perf_counter() - insert_start)
+                read_email_metrics.inc_emails_stored(result["inserted"])
+                if result["duplicates"]:
+                    logger.info("邮箱 %s 有 %d 封邮件已存在, 跳过", email['address'], result["duplicates"])
+                status = "success"
+            elif emails.status == "no_mail":
+                logger.info("邮箱 %s 没有新邮件", email['address'])
+                status = "no_mail"
+            else:
+                logger.warning("为 %s 未读取到邮件", email['address'])
+                error = emails.error or "未读取到邮件"
+                if emails.infrastructure:
+                    status = "unavailable"
+            if status not in ("error", "unavailable") and not status_writer:
+                logger.info("更新邮箱 %s 的 is_need_check", email['address'])
+                with read_email_tracing.span("db_update_status"):
+                    db_manager.update_is_need_check(email['address'])
+        except Exception as e:
+            logger.error("处理邮箱 %s 时出错: %s", email['address'], e)
+            read_email_metrics.inc_error("process", e)
+            check_span.set_attribute("error", f"{type(e).__name__}: {e}")
+            status = "unavailable" if is_infrastructure_error(e) else "error"
+            error = f"process {type(e).__name__}: {e}"
+        finally:
+            check_span.set_attribute("result", status)
+            if status_writer:
+                status_writer.record(email['address'], status, worker_id, error)
+            elif status in ("error", "unavailable"):
+                try:
+                    db_manager.apply_check_results([(email['address'], status, worker_id, time.time(), error)])
+                except Exception as e:
+                    logger.error("记录邮箱 %s 的失败时出错, 领取将在租约到期后释放: %s", email['address'], e)
+            db_manager.close_connection()
 
 
-def main_loop(polling_interval=60, max_workers=5):
+def main_loop(polling_interval=60, max_workers=5, batch_size=None, lease_seconds=1800, worker_id=None,
+              use_notify=True, queue_size=None, warm_sessions=0, warm_idle_ttl=600,
+              warm_memory_ceiling_mb=None, max_messages_per_visit=1, content_retention_months=None,
+              partition_months_ahead=3, status_batch_size=100, status_flush_interval=2.0, shard=None,
+              downloader=None, adaptive_min_workers=None, adaptive_latency_p95=None, adaptive_min_free_mb=1024,
+              metrics_port=None, trace_exporter=None, trace_path=read_email_tracing.DEFAULT_TRACE_PATH,
+              otlp_endpoint=None, wait_policy=None, lightweight=False, reap_orphans_interval=300):
     """
-    主循环，持续监控并并发处理邮件
+    主循环，持续领取邮箱并交给常驻线程池处理
+    通过 claim_need_check_batch 原子领取, 多个实例可以同时运行而不会重复处理同一个账号
+    只领取线程池当前能容纳的数量, 任一线程空闲即可领取下一个邮箱, 不再等待整批完成
+    use_notify 为 True 时由 NOTIFY 唤醒, polling_interval 作为兜底的最长等待时间
+    warm_sessions 大于 0 时启用热会话缓存, 最多保留该数量的空闲浏览器
+    max_messages_per_visit: 每次检查最多读取的新邮件数
+    outlook_email_content 为分区表时, 每小时预建后续 partition_months_ahead 个月的分区,
+    设置 content_retention_months 时同时清理过期分区
+    检查结果攒够 status_batch_size 条或每 status_flush_interval 秒批量回写一次
+    shard 为 (分片序号, 分片数) 时只领取该分片的邮箱; downloader 可传入预先配置好的 OutlookEmailFetcher
+    设置 adaptive_min_workers 时启用自适应并发, 在 [adaptive_min_workers, max_workers] 内按可用内存、负载和读取耗时调整
+    设置 metrics_port 时在该端口提供 Prometheus 指标(需要 prometheus_client)
+    trace_exporter 为 jsonl 或 otlp 时记录每次账号检查的分阶段 span, 分别写入 trace_path 或导出到 otlp_endpoint
+    wait_policy: 读取过程中的等待策略(WaitPolicy), 默认按页面条件等待
+    lightweight 为 True 时读取过程中屏蔽图片、字体、广告和遥测请求
+    每 reap_orphans_interval 秒清理一次孤儿 profile(见 OrphanProfileReaper), 为 0 或 None 时不清理
     """
-    logger.info("启动主循环, 轮询间隔 %d 秒, 最大并发数 %d", polling_interval, max_workers)
+    batch_size = batch_size or max_workers * 4
+    worker_id = worker_id or default_worker_id()
+    logger.info("启动主循环 %s, 轮询间隔 %d 秒, 最大并发数 %d, 每批最多领取 %d, 租约 %d 秒, NOTIFY 唤醒 %s",
+                worker_id, polling_interval, max_workers, batch_size, lease_seconds, use_notify)
+    listener = NeedCheckListener() if use_notify else None
+
+    def wait_for_work():
+        """等待下一轮: 有通知时提前唤醒, 否则最多等待 polling_interval 秒"""
+        if listener:
+            listener.wait(polling_interval)
+        else:
+            time.sleep(polling_interval)
+
+    # 每个工作线程各占一个连接, 主循环领取和检查结果回写各占一个
     connection_pool = ThreadedConnectionPool(
         minconn=1,
-        maxconn=max_workers,
+        maxconn=max_workers + 2,
         user=os.getenv("DB_USER"),
         password=os.getenv("DB_PASSWORD"),
         host=os.getenv("DB_HOST"),
@@ -418,34 +2312,77 @@ def main_loop(polling_interval=60, max_workers=5):
     )
 
     db_manager = PostgresDBManager(connection_pool=connection_pool)
-    downloader = OutlookEmailFetcher()
+    db_manager.ensure_schema()
+    downloader = downloader or OutlookEmailFetcher(wait_policy=wait_policy, block_resources=lightweight)
+    if warm_sessions:
+        downloader.enable_warm_sessions(warm_sessions, warm_idle_ttl, warm_memory_ceiling_mb)
+    status_writer = CheckStatusWriter(connection_pool, status_batch_size, status_flush_interval)
+    status_writer.start()
+    worker_pool = EmailWorkerPool(
+        lambda email: process_email_task(email, downloader, connection_pool, worker_id, max_messages_per_visit,
+                                         status_writer),
+        worker_count=max_workers,
+        queue_size=queue_size
+    )
+    worker_pool.start()
+    if trace_exporter:
+        read_email_tracing.configure(trace_exporter, trace_path, otlp_endpoint)
+    if metrics_port:
+        read_email_metrics.enable(metrics_port)
+        read_email_metrics.register_adspower_client(downloader.client)
+        read_email_metrics.register_worker_pool(worker_pool)
+    controller = None
+    if adaptive_min_workers:
+        controller = AdaptiveConcurrencyController(
+            worker_pool,
+            min_workers=adaptive_min_workers,
+            max_workers=max_workers,
+            min_free_mb=adaptive_min_free_mb,
+            latency_p95=adaptive_latency_p95,
+        )
+        downloader.add_phase_listener(controller.observe)
+    reaper = OrphanProfileReaper(downloader, reap_orphans_interval) if reap_orphans_interval else None
+    last_maintenance = None
 
     try:
         while True:
             try:
-                # 查询符合条件的邮箱
-                logger.info(20*"=" + "开始查询需要读取邮件的邮箱账号" + 20*"=")
-                valid_emails = db_manager.query_need_check_emails()
+                if last_maintenance is None or time.monotonic() - last_maintenance > PARTITION_MAINTENANCE_INTERVAL:
+                    last_maintenance = time.monotonic()
+                    db_manager.maintain_content_partitions(partition_months_ahead, content_retention_months)
+                    if controller:
+                        logger.info("自适应并发状态: %s", controller.snapshot())
+                if downloader.session_cache:
+                    downloader.session_cache.evict()
+                if reaper:
+                    reaper.scan(db_manager)
+                if controller:
+                    controller.adjust()
+                free_slots = worker_pool.free_slots()
+                if free_slots <= 0:
+                    logger.debug("线程池已满, 等待空闲线程")
+                    worker_pool.wait_for_slot(polling_interval)
+                    continue
+
+                # 领取符合条件的邮箱
+                logger.info(20*"=" + "开始领取需要读取邮件的邮箱账号" + 20*"=")
+                db_manager.release_expired_claims()
+                limit = min(free_slots, batch_size)
+                valid_emails = db_manager.claim_need_check_batch(limit, worker_id, lease_seconds, shard)
+                read_email_metrics.inc_accounts_claimed(len(valid_emails))
                 if not valid_emails:
-                    logger.info("未找到符合条件的邮箱, 等待下次轮询")
-                    time.sleep(polling_interval)
+                    logger.info("未找到符合条件的邮箱, 等待通知或下次轮询")
+                    wait_for_work()
                     continue
 
-                # 并发处理邮箱
-                logger.info("开始并发处理 %d 个邮箱", len(valid_emails))
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    futures = [
-                        executor.submit(process_email_task, email, downloader, connection_pool)
-                        for email in valid_emails
-                    ]
-                    for future in as_completed(futures):
-                        try:
-                            future.result()
-                        except Exception as e:
-                            logger.error("并发任务出错: %s", e)
+                logger.info("提交 %d 个邮箱到线程池, 处理中 %d, 排队 %d",
+                            len(valid_emails), worker_pool.active_count(), worker_pool.queued_count())
+                for email in valid_emails:
+                    worker_pool.submit(email)
 
-                logger.info("完成一批处理，等待 %d 秒", polling_interval)
-                time.sleep(polling_interval)
+                # 领取数少于可容纳数说明表中已无待处理邮箱, 等待通知或下次轮询
+                if len(valid_emails) < limit:
+                    wait_for_work()
 
             except Exception as e:
                 logger.error("主循环迭代出错: %s", e)
@@ -456,6 +2393,18 @@ def main_loop(polling_interval=60, max_workers=5):
     except Exception as e:
         logger.error("主循环致命错误: %s", e)
     finally:
+        # 未开始处理的邮箱释放领取, 以便其他实例立即接手
+        for email in worker_pool.drain():
+            db_manager.release_claim(email['address'], worker_id)
+        worker_pool.stop()
+        if controller:
+            logger.info("自适应并发状态: %s", controller.snapshot())
+        status_writer.close()
+        read_email_tracing.shutdown()
+        if downloader.session_cache:
+            downloader.session_cache.close_all()
+        if listener:
+            listener.close()
         db_manager.close_connection()
         connection_pool.closeall()
         logger.info("连接池已关闭，程序终止")
@@ -475,6 +2424,8 @@ def main():
         # logger.info("开始创建数据库表")
         # db_manager.create_email_content_table()
         # db_manager.create_email_list_table()
+        # db_manager.create_sync_cursor_table()
+        # db_manager.explain_need_check_plan()
 
         # 处理符合条件的邮箱
         logger.info("查询符合条件的邮箱列表")
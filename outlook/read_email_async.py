@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+read_email 的 asyncio 流水线模式
+数据库(asyncpg)和 AdsPower API(aiohttp)调用在事件循环中异步执行, 只有 Selenium 操作放在有界线程池中,
+三个阶段各有独立的并发上限: 浏览器较远或瓶颈在 I/O 时, 单个进程可以同时推进更多 profile
+
+依赖 asyncpg 和 aiohttp(可选依赖, 仅本模式需要):
+    pip install asyncpg aiohttp
+
+用法:
+    python read_email_async.py
+"""
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from adspower_client import (
+    AdsPowerError, AdsPowerUnavailableError, DEFAULT_API_URL, START_PATH, STOP_PATH, EndpointStats,
+)
+from read_email import (
+    CHECK_RESULT_ASSIGNMENTS,
+    CLAIM_NEED_CHECK_QUERY,
+    INSERT_EMAIL_CONTENT_QUERY,
+    NEED_CHECK_CHANNEL,
+    RELEASE_EXPIRED_CLAIMS_QUERY,
+    UPSERT_SYNC_CURSOR_QUERY,
+    AdsPowerSession,
+    FetchResult,
+    OutlookEmailFetcher,
+    PostgresDBManager,
+    _hashed_rows,
+    default_worker_id,
+    is_infrastructure_error,
+)
+import read_email_tracing
+
+
+logger = logging.getLogger(__name__)
+
+APPLY_CHECK_RESULTS_QUERY = f'''
+    UPDATE
+        outlook_email_list AS l
+    SET {CHECK_RESULT_ASSIGNMENTS}
+    FROM
+        unnest($1::varchar[], $2::varchar[], $3::varchar[], $4::float8[], $5::text[])
+            AS v (address, status, worker_id, checked_at, error)
+    WHERE
+        l.address = v.address
+        AND (v.status NOT IN ('error', 'unavailable') OR l.claimed_by IS NULL OR l.claimed_by = v.worker_id);
+'''
+
+
+def _is_infrastructure_error(error):
+    """在 read_email.is_infrastructure_error 的基础上, asyncpg 的连接错误也视为基础设施故障"""
+    if asyncpg is not None and isinstance(error, (asyncpg.PostgresConnectionError, asyncpg.InterfaceError)):
+        return True
+    return is_infrastructure_error(error)
+
+
+def _numbered_params(query):
+    """将 psycopg2 的 %s 占位符按顺序转换为 asyncpg 的 $1, $2 ..."""
+    counter = iter(range(1, query.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f"${next(counter)}", query)
+
+
+ASYNC_INSERT_EMAIL_CONTENT_QUERY = _numbered_params(INSERT_EMAIL_CONTENT_QUERY.format(
+    source="unnest(%s::varchar[], %s::varchar[], %s::text[], %s::bpchar[])"))
+
+
+def _require(module, name):
+    if module is None:
+        raise RuntimeError(f"异步模式需要安装 {name}: pip install {name}")
+
+
+class AsyncDBManager:
+    """
+    基于 asyncpg 连接池的数据库操作, 与 PostgresDBManager 中对应方法的语义一致
+    """
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    async def create(cls, min_size=1, max_size=10):
+        """按 .env 中的数据库配置创建连接池"""
+        _require(asyncpg, "asyncpg")
+        pool = await asyncpg.create_pool(
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            database=os.getenv("DB_NAME"),
+            min_size=min_size,
+            max_size=max_size,
+        )
+        logger.info("asyncpg 连接池已建立, 连接数 %d-%d", min_size, max_size)
+        return cls(pool)
+
+    async def close(self):
+        await self.pool.close()
+
+    async def claim_need_check_batch(self, limit, worker_id, lease_seconds=1800):
+        """原子领取一批需要检查的邮箱, 见 PostgresDBManager.claim_need_check_batch"""
+        try:
+            rows = await self.pool.fetch(_numbered_params(CLAIM_NEED_CHECK_QUERY),
+                                         limit, worker_id, float(lease_seconds))
+            logger.info("%s 领取到 %d 条需要检查的邮箱记录, 租约 %d 秒", worker_id, len(rows), lease_seconds)
+            return [{"address": row[0], "ads_browser_id": row[1]} for row in rows]
+        except Exception as error:
+            logger.error("领取 outlook_email_list 记录时出错: %s", error)
+            return []
+
+    async def release_expired_claims(self):
+        """清理已过期的租约"""
+        try:
+            status = await self.pool.execute(_numbered_params(RELEASE_EXPIRED_CLAIMS_QUERY))
+            count = int(status.split()[-1])
+            if count:
+                logger.warning("%d 条邮箱记录的租约已过期, 重新放回队列", count)
+            return count
+        except Exception as error:
+            logger.error("清理过期租约时出错: %s", error)
+            return 0
+
+    async def get_sync_cursor(self, email_address):
+        """查询账号的同步游标, 没有记录或出错时返回 None"""
+        try:
+            return await self.pool.fetchval(
+                "SELECT last_message_key FROM outlook_sync_cursor WHERE email_address = $1;", email_address
+            )
+        except Exception as error:
+            logger.error("查询邮箱 %s 的同步游标时出错: %s", email_address, error)
+            return None
+
+    async def update_sync_cursor(self, email_address, message_key, subject=None):
+        """更新账号的同步游标"""
+        await self.pool.execute(_numbered_params(UPSERT_SYNC_CURSOR_QUERY), email_address, message_key, (subject or '')[:255])
+        logger.info("邮箱 %s 的同步游标已更新为 %s", email_address, message_key)
+
+    async def insert_email_content(self, email_data):
+        """按 (email_address, content_hash) 去重写入邮件, 返回 {"inserted", "duplicates"}"""
+        values, total = _hashed_rows(email_data)
+        if not values:
+            return {"inserted": 0, "duplicates": 0}
+        columns = list(zip(*values))
+        rows = await self.pool.fetch(ASYNC_INSERT_EMAIL_CONTENT_QUERY, *[list(column) for column in columns])
+        inserted = len(rows)
+        logger.info("向 outlook_email_content 表插入 %d 条数据成功, 重复跳过 %d 条", inserted, total - inserted)
+        return {"inserted": inserted, "duplicates": total - inserted}
+
+    async def apply_check_results(self, results):
+        """批量回写检查结果, 见 PostgresDBManager.apply_check_results"""
+        if not results:
+            return 0
+        columns = [list(column) for column in zip(*results)]
+        status = await self.pool.execute(APPLY_CHECK_RESULTS_QUERY, *columns)
+        count = int(status.split()[-1])
+        logger.info("批量回写 %d 个邮箱的检查结果, 更新 %d 行", len(results), count)
+        return count
+
+    async def listen(self, channel, callback):
+        """
+        占用一个连接监听 NOTIFY, 返回该连接; 关闭时先 remove_listener 再 release
+        """
+        connection = await self.pool.acquire()
+        await connection.add_listener(channel, callback)
+        logger.info("开始监听 NOTIFY 频道 %s", channel)
+        return connection
+
+
+class AsyncAdsPowerClient:
+    """
+    基于 aiohttp 的 AdsPower 本地 API 客户端, 超时、退避重试和启动并发限制与 AdsPowerClient 一致
+    """
+    def __init__(self, base_url=DEFAULT_API_URL, connect_timeout=3, read_timeout=60,
+                 max_retries=3, backoff=0.5, max_backoff=8, max_concurrent_starts=3, pool_size=16):
+        _require(aiohttp, "aiohttp")
+        self.base_url = base_url.rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.start_limiter = asyncio.Semaphore(max_concurrent_starts)
+        self.session = None
+        self.stats = {}
+
+    def _record(self, path, seconds, ok):
+        self.stats.setdefault(path, EndpointStats()).record(seconds, ok)
+
+    async def _request(self, path, payload):
+        """发送 POST 请求并返回响应 JSON, 网络错误/限流/5xx 按退避重试"""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                timeout=self.timeout, connector=aiohttp.TCPConnector(limit=self.pool_size)
+            )
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                async with self.session.post(url, json=payload) as response:
+                    text = await response.text()
+                    if response.status == 429 or response.status >= 500:
+                        raise aiohttp.ClientResponseError(response.request_info, (), status=response.status,
+                                                          message=text)
+                    if response.status != 200:
+                        self._record(path, time.perf_counter() - start, False)
+                        raise AdsPowerError(f"API 请求失败({response.status}): {text}")
+                    data = await response.json(content_type=None)
+                code, msg = data.get("code"), str(data.get("msg", ""))
+                if code != 0 and "too many request" not in msg.lower():
+                    self._record(path, time.perf_counter() - start, False)
+                    raise AdsPowerError(msg)
+                if code == 0:
+                    self._record(path, time.perf_counter() - start, True)
+                    return data
+                error = f"API 限流: {msg}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            except ValueError as e:
+                self._record(path, time.perf_counter() - start, False)
+                raise AdsPowerUnavailableError(f"API 返回内容无法解析: {e}") from e
+            self._record(path, time.perf_counter() - start, False)
+            if attempt >= self.max_retries:
+                raise AdsPowerUnavailableError(f"{path} 重试 {self.max_retries} 次后仍失败: {error}")
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            logger.warning("AdsPower 请求 %s 失败(第 %d 次), %.2f 秒后重试: %s", path, attempt + 1, delay, error)
+            await asyncio.sleep(delay)
+
+    async def start_profile(self, profile_id, proxy_detection="0", **extra):
+        """启动 profile, 返回 API 的 data 字段"""
+        payload = {"profile_id": profile_id, "proxy_detection": proxy_detection}
+        payload.update(extra)
+        async with self.start_limiter:
+            data = await self._request(START_PATH, payload)
+        return data["data"]
+
+    async def stop_profile(self, profile_id):
+        """关闭 profile"""
+        await self._request(STOP_PATH, {"profile_id": profile_id})
+
+    def latency_stats(self):
+        return {path: stats.snapshot() for path, stats in self.stats.items()}
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncEmailPipeline:
+    """
+    异步处理流水线: 领取 -> 查询游标(DB) -> 启动 profile(API) -> 读取收件箱(浏览器线程) -> 关闭 profile(API)
+    -> 写入邮件和游标(DB) -> 批量回写检查结果(DB), 每个阶段受各自的信号量限制
+    """
+    def __init__(self, db, api, fetcher, worker_id=None, db_concurrency=10, api_concurrency=10,
+                 browser_concurrency=5, max_in_flight=None, lease_seconds=1800, max_messages=1,
+                 status_batch_size=100, status_flush_interval=2.0):
+        """
+        db_concurrency / api_concurrency / browser_concurrency: 三个阶段各自的并发上限
+        max_in_flight: 同时处理中的邮箱上限, 默认为浏览器并发数的两倍, 使 API 和 DB 阶段与浏览器阶段重叠
+        """
+        self.db = db
+        self.api = api
+        self.fetcher = fetcher
+        self.worker_id = worker_id or default_worker_id()
+        self.db_limiter = asyncio.Semaphore(db_concurrency)
+        self.api_limiter = asyncio.Semaphore(api_concurrency)
+        self.browser_limiter = asyncio.Semaphore(browser_concurrency)
+        self.browser_executor = ThreadPoolExecutor(max_workers=browser_concurrency, thread_name_prefix="browser")
+        self.max_in_flight = max_in_flight or browser_concurrency * 2
+        self.lease_seconds = lease_seconds
+        self.max_messages = max_messages
+        self.status_batch_size = status_batch_size
+        self.status_flush_interval = status_flush_interval
+        self.tasks = set()
+        self.pending_results = {}
+        self.work_available = asyncio.Event()
+
+    def _read_in_browser(self, session, selenium_address, email_address, since_key):
+        """
+        浏览器线程中执行: 挂载到已启动的 profile 并读取收件箱
+        profile 由流水线启动和关闭, 会话退出时只退出 WebDriver
+        """
+        with session:
+            session.attach(selenium_address)
+            return self.fetcher.read_inbox(session, email_address, since_key, self.max_messages)
+
+    async def fetch(self, email_address, ads_browser_id, since_key):
+        """异步启动 profile, 在浏览器线程中读取, 再异步关闭 profile"""
+        session = AdsPowerSession(self.fetcher, ads_browser_id)
+        emails = FetchResult()
+        self.fetcher.track_session(session)
+        try:
+            async with self.api_limiter:
+                with session.phase("adspower_start"):
+                    data = await self.api.start_profile(ads_browser_id)
+            logger.info("成功启动 AdsPower 浏览器 %s", ads_browser_id)
+            try:
+                async with self.browser_limiter:
+                    # 复制当前上下文, 浏览器线程中的阶段 span 挂在本次账号检查之下
+                    emails = await asyncio.get_running_loop().run_in_executor(
+                        self.browser_executor, contextvars.copy_context().run, self._read_in_browser,
+                        session, data["ws"]["selenium"], email_address, since_key
+                    )
+            finally:
+                async with self.api_limiter:
+                    with session.phase("adspower_stop"):
+                        try:
+                            await self.api.stop_profile(ads_browser_id)
+                            logger.info("AdsPower 浏览器 %s 已关闭", ads_browser_id)
+                        except AdsPowerError as e:
+                            logger.error("关闭浏览器 %s 失败: %s", ads_browser_id, e)
+        except Exception as e:
+            logger.error("处理 AdsPower 浏览器 %s 时出错: %s", ads_browser_id, e)
+            emails.error = f"fetch {type(e).__name__}: {e}"
+            emails.infrastructure = _is_infrastructure_error(e)
+        finally:
+            self.fetcher.untrack_session(session)
+        self.fetcher.report_phases(email_address, ads_browser_id, session)
+        return emails
+
+    async def process(self, email):
+        """处理单个邮箱, 结果放入待回写缓冲区"""
+        address = email['address']
+        status = "error"
+        error = None
+        with read_email_tracing.span("account_check", ads_browser_id=email['ads_browser_id'],
+                                     email_address=address, worker_id=self.worker_id) as check_span:
+            try:
+                async with self.db_limiter:
+                    with read_email_tracing.span("db_sync_cursor"):
+                        since_key = await self.db.get_sync_cursor(address)
+                emails = await self.fetch(address, email['ads_browser_id'], since_key)
+                if emails:
+                    async with self.db_limiter:
+                        with read_email_tracing.span("db_insert", emails=len(emails)):
+                            result = await self.db.insert_email_content(emails)
+                            await self.db.update_sync_cursor(address, emails[-1]['message_key'],
+                                                             emails[-1]['email_title'])
+                    if result["duplicates"]:
+                        logger.info("邮箱 %s 有 %d 封邮件已存在, 跳过", address, result["duplicates"])
+                    status = "success"
+                elif emails.status == "no_mail":
+                    logger.info("邮箱 %s 没有新邮件", address)
+                    status = "no_mail"
+                else:
+                    logger.warning("为 %s 未读取到邮件", address)
+                    error = emails.error or "未读取到邮件"
+                    if emails.infrastructure:
+                        status = "unavailable"
+            except Exception as e:
+                logger.error("处理邮箱 %s 时出错: %s", address, e)
+                check_span.set_attribute("error", f"{type(e).__name__}: {e}")
+                status = "unavailable" if _is_infrastructure_error(e) else "error"
+                error = f"process {type(e).__name__}: {e}"
+            check_span.set_attribute("result", status)
+        self.pending_results.pop(address, None)
+        self.pending_results[address] = (address, status, self.worker_id, time.time(), error)
+        if len(self.pending_results) >= self.status_batch_size:
+            await self.flush_results()
+
+    async def flush_results(self):
+        """批量回写缓冲区中的检查结果, 失败时保留到下次"""
+        if not self.pending_results:
+            return
+        batch = list(self.pending_results.values())
+        try:
+            async with self.db_limiter:
+                await self.db.apply_check_results(batch)
+        except Exception as e:
+            logger.error("写入 %d 条检查结果失败, 下次重试: %s", len(batch), e)
+            return
+        for address, _, _, checked_at, _ in batch:
+            if self.pending_results.get(address, (None, None, None, None, None))[3] == checked_at:
+                del self.pending_results[address]
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.status_flush_interval)
+            await self.flush_results()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.work_available.set()
+
+    async def run(self, polling_interval=60, batch_size=None, use_notify=True):
+        """
+        主循环: 按空闲容量领取邮箱并创建处理任务, 没有待处理邮箱时等待 NOTIFY 或 polling_interval 秒
+        """
+        batch_size = batch_size or self.max_in_flight
+        logger.info("启动异步主循环 %s, 同时处理上限 %d, 每批最多领取 %d",
+                    self.worker_id, self.max_in_flight, batch_size)
+        listen_connection = None
+        if use_notify:
+            try:
+                listen_connection = await self.db.listen(NEED_CHECK_CHANNEL, self._on_notify)
+            except Exception as e:
+                logger.error("监听 NOTIFY 失败, 退化为定时轮询: %s", e)
+        flusher = asyncio.create_task(self._flush_periodically())
+        slot_freed = asyncio.Event()
+
+        def task_done(task):
+            self.tasks.discard(task)
+            slot_freed.set()
+
+        try:
+            while True:
+                free_slots = self.max_in_flight - len(self.tasks)
+                if free_slots <= 0:
+                    slot_freed.clear()
+                    await slot_freed.wait()
+                    continue
+                await self.db.release_expired_claims()
+                limit = min(free_slots, batch_size)
+                self.work_available.clear()
+                valid_emails = await self.db.claim_need_check_batch(limit, self.worker_id, self.lease_seconds)
+                for email in valid_emails:
+                    task = asyncio.create_task(self.process(email))
+                    self.tasks.add(task)
+                    task.add_done_callback(task_done)
+                if len(valid_emails) < limit:
+                    if not valid_emails:
+                        logger.info("未找到符合条件的邮箱, 等待通知或下次轮询")
+                    try:
+                        await asyncio.wait_for(self.work_available.wait(), polling_interval)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            flusher.cancel()
+            if self.tasks:
+                logger.info("等待 %d 个处理中的邮箱完成", len(self.tasks))
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+            await self.flush_results()
+            if listen_connection:
+                await listen_connection.remove_listener(NEED_CHECK_CHANNEL, self._on_notify)
+                await self.db.pool.release(listen_connection)
+            self.browser_executor.shutdown(wait=True)
+
+
+def _ensure_schema():
+    """启动时用同步连接执行一次 PostgresDBManager.ensure_schema"""
+    db_manager = PostgresDBManager()
+    try:
+        db_manager.ensure_schema()
+    finally:
+        db_manager.close_connection()
+
+
+async def async_main_loop(polling_interval=60, browser_concurrency=5, api_concurrency=10, db_concurrency=10,
+                          max_in_flight=None, batch_size=None, lease_seconds=1800, worker_id=None,
+                          use_notify=True, max_messages_per_visit=1, adspower_api_url=DEFAULT_API_URL,
+                          lightweight=False):
+    """
+    异步模式的主循环, 参数含义与 read_email.main_loop 一致, 并发改为按阶段分别限制
+    """
+    await asyncio.to_thread(_ensure_schema)
+    # 处理任务的 DB 阶段、批量回写和 NOTIFY 监听各需要连接
+    db = await AsyncDBManager.create(max_size=db_concurrency + 2)
+    api = AsyncAdsPowerClient(adspower_api_url)
+    pipeline = AsyncEmailPipeline(
+        db, api, OutlookEmailFetcher(adspower_api_url, block_resources=lightweight),
+        worker_id=worker_id,
+        db_concurrency=db_concurrency,
+        api_concurrency=api_concurrency,
+        browser_concurrency=browser_concurrency,
+        max_in_flight=max_in_flight,
+        lease_seconds=lease_seconds,
+        max_messages=max_messages_per_visit,
+    )
+    try:
+        await pipeline.run(polling_interval, batch_size, use_notify)
+    finally:
+        logger.info("AdsPower 接口延迟: %s", api.latency_stats())
+        await api.close()
+        await db.close()
+        logger.info("连接池已关闭，程序终止")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(async_main_loop(polling_interval=60, browser_concurrency=5))
+    except KeyboardInterrupt:
+        logger.info("收到 KeyboardInterrupt, 程序关闭")
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+read_email 流水线的 Prometheus 指标
+依赖 prometheus_client(可选), 调用 enable(port) 后在该端口提供 /metrics; 未启用时下面的记录函数都是空操作
+
+指标(均带 stage 标签):
+    read_email_stage_duration_seconds   各阶段耗时直方图: adspower_start, adspower_stop, chrome_attach, navigate,
+                                        list_wait, ad_filter, open_message, extract_body(每封邮件), dwell, teardown,
+                                        db_insert, 以及 AdsPower 单次请求 adspower_api_start, adspower_api_stop
+    read_email_accounts_claimed_total   领取的账号数 (stage=claim)
+    read_email_emails_stored_total      新写入的邮件数 (stage=db_insert)
+    read_email_errors_total             按阶段和异常类型统计的错误数
+    read_email_queue_depth              排队中的账号数 (stage=queue)
+    read_email_active_workers           正在处理的账号数 (stage=worker)
+    read_email_concurrency_limit        当前并发上限 (stage=worker)
+    read_email_concurrency_decisions_total  自适应并发的决策次数 (stage=worker, decision)
+"""
+import logging
+
+from adspower_client import START_PATH, STOP_PATH
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# AdsPower 接口路径 -> 阶段名; 单次 HTTP 请求(含每次重试)与 adspower_start/adspower_stop 阶段分开统计
+ADSPOWER_STAGES = {
+    START_PATH: "adspower_api_start",
+    STOP_PATH: "adspower_api_stop",
+}
+
+_metrics = None
+
+
+class _Metrics:
+    def __init__(self, registry):
+        self.stage_duration = prometheus_client.Histogram(
+            "read_email_stage_duration_seconds", "各阶段耗时", ["stage"],
+            buckets=DURATION_BUCKETS, registry=registry,
+        )
+        self.accounts_claimed = prometheus_client.Counter(
+            "read_email_accounts_claimed", "领取的账号数", ["stage"], registry=registry,
+        )
+        self.emails_stored = prometheus_client.Counter(
+            "read_email_emails_stored", "新写入的邮件数", ["stage"], registry=registry,
+        )
+        self.errors = prometheus_client.Counter(
+            "read_email_errors", "错误数", ["stage", "type"], registry=registry,
+        )
+        self.queue_depth = prometheus_client.Gauge(
+            "read_email_queue_depth", "排队中的账号数", ["stage"], registry=registry,
+        )
+        self.active_workers = prometheus_client.Gauge(
+            "read_email_active_workers", "正在处理的账号数", ["stage"], registry=registry,
+        )
+        self.concurrency_limit = prometheus_client.Gauge(
+            "read_email_concurrency_limit", "当前并发上限", ["stage"], registry=registry,
+        )
+        self.concurrency_decisions = prometheus_client.Counter(
+            "read_email_concurrency_decisions", "自适应并发的决策次数", ["stage", "decision"], registry=registry,
+        )
+
+
+def enable(port, addr="0.0.0.0", registry=None):
+    """
+    启动 /metrics HTTP 服务并开始记录指标, 重复调用只启动一次
+    """
+    global _metrics
+    if prometheus_client is None:
+        raise RuntimeError("启用指标需要安装 prometheus_client: pip install prometheus_client")
+    if _metrics is not None:
+        return
+    registry = registry or prometheus_client.REGISTRY
+    _metrics = _Metrics(registry)
+    prometheus_client.start_http_server(port, addr=addr, registry=registry)
+    logger.info("Prometheus 指标已启用: http://%s:%d/metrics", addr, port)
+
+
+def enabled():
+    return _metrics is not None
+
+
+def observe_stage(stage, seconds):
+    """记录一次阶段耗时"""
+    if _metrics:
+        _metrics.stage_duration.labels(stage=stage).observe(seconds)
+
+
+def inc_accounts_claimed(count):
+    if _metrics and count:
+        _metrics.accounts_claimed.labels(stage="claim").inc(count)
+
+
+def inc_emails_stored(count):
+    if _metrics and count:
+        _metrics.emails_stored.labels(stage="db_insert").inc(count)
+
+
+def inc_error(stage, error):
+    """记录一次错误, error 为异常实例或类型名"""
+    if _metrics:
+        error_type = error if isinstance(error, str) else type(error).__name__
+        _metrics.errors.labels(stage=stage, type=error_type).inc()
+
+
+def record_concurrency_decision(decision):
+    if _metrics:
+        _metrics.concurrency_decisions.labels(stage="worker", decision=decision).inc()
+
+
+def register_worker_pool(worker_pool):
+    """排队数、处理中数和并发上限在抓取时从线程池读取"""
+    if _metrics:
+        _metrics.queue_depth.labels(stage="queue").set_function(worker_pool.queued_count)
+        _metrics.active_workers.labels(stage="worker").set_function(worker_pool.active_count)
+        _metrics.concurrency_limit.labels(stage="worker").set_function(lambda: worker_pool.limit)
+
+
+def _observe_adspower(path, seconds, ok, error=None):
+    stage = ADSPOWER_STAGES.get(path, path)
+    observe_stage(stage, seconds)
+    if not ok:
+        inc_error(stage, error or "AdsPowerError")
+
+
+def register_adspower_client(client):
+    """记录 AdsPowerClient 每次请求的耗时和错误"""
+    if _metrics:
+        client.add_observer(_observe_adspower)
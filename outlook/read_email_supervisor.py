@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+read_email 多进程运行入口
+启动 K 个 worker 进程, 每个进程有独立的连接池、OutlookEmailFetcher 和线程池, 各自运行 main_loop;
+账号默认通过数据库领取机制分配(多个进程/主机共享同一个队列), 也可以按 ads_browser_id 哈希固定分片.
+worker 异常退出时自动重启, 各 worker 定期上报阶段耗时和 AdsPower 接口统计, 由 supervisor 汇总输出
+
+用法:
+    python read_email_supervisor.py --processes 4 --max-workers 5
+    python read_email_supervisor.py --processes 4 --shard-by-hash      # 按哈希分片, 每个进程只处理自己的分片
+"""
+import time
+import queue
+import logging
+import argparse
+import threading
+import multiprocessing
+
+
+logger = logging.getLogger(__name__)
+
+# worker 连续快速崩溃时的重启间隔上限(秒)
+MAX_RESTART_DELAY = 60
+# 存活超过该秒数的 worker 退出后, 重启间隔从头计算
+STABLE_RUN_SECONDS = 300
+
+
+class WorkerMetrics:
+    """
+    worker 进程内的累计指标, 作为 OutlookEmailFetcher 的阶段回调
+    """
+    def __init__(self):
+        self.fetches = 0
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, email_address, ads_browser_id, timings):
+        with self.lock:
+            self.fetches += 1
+            for name, seconds in timings.items():
+                count, total = self.phases.get(name, (0, 0.0))
+                self.phases[name] = (count + 1, total + seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {"fetches": self.fetches, "phases": dict(self.phases)}
+
+
+def _report_metrics(shard_index, metrics, client, metrics_queue, interval):
+    """worker 内的上报线程: 每 interval 秒发送一次累计指标"""
+    while True:
+        time.sleep(interval)
+        snapshot = metrics.snapshot()
+        snapshot["adspower"] = client.latency_stats()
+        try:
+            metrics_queue.put_nowait((shard_index, snapshot))
+        except queue.Full:
+            pass
+
+
+def worker_main(shard_index, shard_count, shard_by_hash, metrics_queue, report_interval, loop_kwargs,
+                metrics_port=None):
+    """
+    worker 进程入口: 创建自己的 fetcher 并运行 main_loop
+    metrics_port 为基准端口, 每个 worker 在 metrics_port + shard_index 上提供 Prometheus 指标
+    """
+    # 在子进程中导入, 各进程各自加载 .env 并建立连接
+    from read_email import OutlookEmailFetcher, default_worker_id, main_loop
+
+    metrics = WorkerMetrics()
+    downloader = OutlookEmailFetcher(block_resources=loop_kwargs.pop("lightweight", False))
+    downloader.add_phase_listener(metrics)
+    threading.Thread(
+        target=_report_metrics,
+        args=(shard_index, metrics, downloader.client, metrics_queue, report_interval),
+        name="metrics-reporter",
+        daemon=True,
+    ).start()
+    main_loop(
+        worker_id=f"{default_worker_id()}-s{shard_index}",
+        shard=(shard_index, shard_count) if shard_by_hash else None,
+        downloader=downloader,
+        metrics_port=metrics_port + shard_index if metrics_port else None,
+        **loop_kwargs
+    )
+
+
+class MetricsAggregator:
+    """
+    汇总各 worker 上报的累计指标; worker 重启后计数归零, 旧进程最后一次上报的数据计入 retired
+    """
+    def __init__(self):
+        self.latest = {}
+        self.retired = {"fetches": 0, "phases": {}, "adspower": {}}
+
+    def update(self, shard_index, snapshot):
+        self.latest[shard_index] = snapshot
+
+    def retire(self, shard_index):
+        snapshot = self.latest.pop(shard_index, None)
+        if snapshot:
+            self.retired = self._merge([self.retired, snapshot])
+
+    @staticmethod
+    def _merge(snapshots):
+        fetches = 0
+        phases = {}
+        adspower = {}
+        for snapshot in snapshots:
+            fetches += snapshot["fetches"]
+            for name, (count, total) in snapshot["phases"].items():
+                merged_count, merged_total = phases.get(name, (0, 0.0))
+                phases[name] = (merged_count + count, merged_total + total)
+            for path, stats in snapshot.get("adspower", {}).items():
+                merged = adspower.setdefault(path, {"count": 0, "errors": 0, "p95": 0.0, "max": 0.0})
+                merged["count"] += stats["count"]
+                merged["errors"] += stats["errors"]
+                # 分位数无法精确合并, 取各 worker 的最大值作为上界
+                merged["p95"] = max(merged["p95"], stats["p95"])
+                merged["max"] = max(merged["max"], stats["max"])
+        return {"fetches": fetches, "phases": phases, "adspower": adspower}
+
+    def totals(self):
+        return self._merge([self.retired] + list(self.latest.values()))
+
+    def log(self, wall_seconds):
+        totals = self.totals()
+        rate = totals["fetches"] / wall_seconds * 3600 if wall_seconds > 0 else 0.0
+        logger.info("全部 worker 累计读取 %d 次, 约 %.0f 账号/小时", totals["fetches"], rate)
+        for name, (count, total) in sorted(totals["phases"].items()):
+            logger.info("  阶段 %-14s 次数 %6d 平均 %.3f 秒", name, count, total / count if count else 0.0)
+        for path, stats in totals["adspower"].items():
+            logger.info("  AdsPower %s 调用 %d 次, 错误 %d 次, p95<=%.3f 秒, max %.3f 秒",
+                        path, stats["count"], stats["errors"], stats["p95"], stats["max"])
+
+
+class Supervisor:
+    """
+    管理 K 个 worker 进程: 启动、崩溃重启(指数退避)、汇总指标、退出时等待所有 worker 结束
+    """
+    def __init__(self, processes=2, shard_by_hash=False, report_interval=30, metrics_port=None, **loop_kwargs):
+        self.processes = processes
+        self.metrics_port = metrics_port
+        self.shard_by_hash = shard_by_hash
+        self.report_interval = report_interval
+        self.loop_kwargs = loop_kwargs
+        self.context = multiprocessing.get_context("spawn")
+        self.metrics_queue = self.context.Queue(maxsize=processes * 100)
+        self.aggregator = MetricsAggregator()
+        self.workers = {}
+        self.restart_delay = {}
+        self.restart_at = {}
+
+    def _spawn(self, shard_index):
+        process = self.context.Process(
+            target=worker_main,
+            args=(shard_index, self.processes, self.shard_by_hash, self.metrics_queue,
+                  self.report_interval, self.loop_kwargs, self.metrics_port),
+            name=f"read-email-{shard_index}",
+        )
+        process.start()
+        self.workers[shard_index] = (process, time.monotonic())
+        logger.info("worker %d 已启动, pid %d", shard_index, process.pid)
+
+    def _check_workers(self):
+        """重启已退出的 worker, 连续快速崩溃时逐步拉长重启间隔"""
+        now = time.monotonic()
+        for shard_index, (process, started) in list(self.workers.items()):
+            if process is None:
+                if now >= self.restart_at.get(shard_index, 0):
+                    self._spawn(shard_index)
+                continue
+            if process.is_alive():
+                continue
+            self.aggregator.retire(shard_index)
+            if now - started > STABLE_RUN_SECONDS:
+                self.restart_delay[shard_index] = 1
+            else:
+                self.restart_delay[shard_index] = min(MAX_RESTART_DELAY, self.restart_delay.get(shard_index, 0.5) * 2)
+            delay = self.restart_delay[shard_index]
+            logger.error("worker %d (pid %d) 已退出, 退出码 %s, %.0f 秒后重启",
+                         shard_index, process.pid, process.exitcode, delay)
+            self.workers[shard_index] = (None, started)
+            self.restart_at[shard_index] = now + delay
+
+    def _drain_metrics(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                shard_index, snapshot = self.metrics_queue.get(timeout=remaining)
+            except queue.Empty:
+                return
+            self.aggregator.update(shard_index, snapshot)
+
+    def run(self):
+        logger.info("启动 %d 个 worker 进程, 分配方式: %s", self.processes,
+                    "哈希分片" if self.shard_by_hash else "数据库领取")
+        wall_start = time.monotonic()
+        last_log = wall_start
+        for shard_index in range(self.processes):
+            self._spawn(shard_index)
+        try:
+            while True:
+                self._drain_metrics(1)
+                self._check_workers()
+                if time.monotonic() - last_log >= self.report_interval:
+                    last_log = time.monotonic()
+                    self.aggregator.log(last_log - wall_start)
+        except KeyboardInterrupt:
+            logger.info("收到 KeyboardInterrupt, 等待 worker 退出")
+        finally:
+            self.stop()
+            self.aggregator.log(time.monotonic() - wall_start)
+
+    def stop(self, timeout=120):
+        """
+        等待 worker 结束: Ctrl+C 会同时发送给子进程, 由 main_loop 自行清理; 超时未退出的强制终止
+        """
+        deadline = time.monotonic() + timeout
+        for shard_index, (process, _) in self.workers.items():
+            if process is None:
+                continue
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("worker %d (pid %d) 未在 %d 秒内退出, 强制终止", shard_index, process.pid, timeout)
+                process.terminate()
+                process.join(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="read_email 多进程运行入口")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(), help="worker 进程数")
+    parser.add_argument("--shard-by-hash", action="store_true",
+                        help="按 ads_browser_id 哈希分片, 默认所有进程通过数据库领取共享队列")
+    parser.add_argument("--max-workers", type=int, default=5, help="每个进程的浏览器线程数")
+    parser.add_argument("--adaptive-min-workers", type=int,
+                        help="启用自适应并发, 每个进程的并发在该值和 --max-workers 之间按主机资源调整")
+    parser.add_argument("--polling-interval", type=int, default=60)
+    parser.add_argument("--lease-seconds", type=int, default=1800)
+    parser.add_argument("--report-interval", type=int, default=30, help="汇总指标的输出间隔(秒)")
+    parser.add_argument("--lightweight", action="store_true", help="读取时屏蔽图片、字体、广告和遥测请求")
+    parser.add_argument("--trace", choices=("jsonl", "otlp"), help="记录分阶段追踪 span")
+    parser.add_argument("--trace-path", default="read_email_spans.jsonl", help="--trace jsonl 时写入的文件")
+    parser.add_argument("--otlp-endpoint", help="--trace otlp 时的导出地址")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Prometheus 指标基准端口, 第 i 个 worker 使用 metrics-port + i")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s-%(levelname)s - %(module)s: %(message)s')
+    Supervisor(
+        processes=args.processes,
+        shard_by_hash=args.shard_by_hash,
+        report_interval=args.report_interval,
+        metrics_port=args.metrics_port,
+        lightweight=args.lightweight,
+        trace_exporter=args.trace,
+        trace_path=args.trace_path,
+        otlp_endpoint=args.otlp_endpoint,
+        max_workers=args.max_workers,
+        adaptive_min_workers=args.adaptive_min_workers,
+        polling_interval=args.polling_interval,
+        lease_seconds=args.lease_seconds,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
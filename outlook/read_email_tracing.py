@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+read_email 的分阶段追踪
+每次账号检查是一个 account_check 根 span, AdsPower 启动、Chrome 挂载、页面加载、列表等待、数据库写入等
+阶段是它的子 span; 子 span 继承根 span 的 ads_browser_id, email_address, worker_id 属性.
+span 可以按 JSON 行写入本地文件, 或通过 OTLP 导出(需要 opentelemetry-sdk 和 opentelemetry-exporter-otlp);
+未调用 configure 时 span() 为空操作
+
+汇总 JSON 行文件:
+    python read_email_tracing.py read_email_spans.jsonl --slowest 5
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACE_PATH = "read_email_spans.jsonl"
+
+# 当前上下文中正在进行的 span, 线程和 asyncio 任务各自独立
+_current_span = contextvars.ContextVar("read_email_current_span", default=None)
+_exporter = None
+
+
+class Span:
+    """
+    一个阶段的记录, 结束时交给导出器
+    """
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_time", "duration",
+                 "status", "error", "otel_span")
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(parent.attributes) if parent else {}
+        self.attributes.update(attributes)
+        self.start_time = time.time()
+        self.duration = None
+        self.status = "ok"
+        self.error = None
+        self.otel_span = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+        if self.otel_span is not None:
+            self.otel_span.set_attribute(key, value)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class JsonLinesExporter:
+    """
+    每个结束的 span 写一行 JSON; 追加模式且每行一次写入, 多个进程可以写同一个文件
+    """
+    def __init__(self, path=DEFAULT_TRACE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def start(self, span):
+        pass
+
+    def end(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class OtlpExporter:
+    """
+    通过 OpenTelemetry SDK 以 OTLP 导出, span 的父子关系由 OpenTelemetry 的上下文维护
+    """
+    def __init__(self, endpoint=None, service_name="read_email"):
+        try:
+            from opentelemetry import trace
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        except ImportError as e:
+            raise RuntimeError("OTLP 导出需要安装 opentelemetry-sdk 和 opentelemetry-exporter-otlp") from e
+        self.trace = trace
+        self.provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        self.provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+        self.tracer = self.provider.get_tracer("read_email")
+
+    def start(self, span):
+        parent = _current_span.get()
+        context = None
+        if parent is not None and parent.otel_span is not None:
+            context = self.trace.set_span_in_context(parent.otel_span)
+        span.otel_span = self.tracer.start_span(span.name, context=context, attributes=span.attributes)
+
+    def end(self, span):
+        if span.status == "error":
+            span.otel_span.set_status(self.trace.Status(self.trace.StatusCode.ERROR, span.error))
+        span.otel_span.end()
+
+    def close(self):
+        self.provider.shutdown()
+
+
+def configure(exporter="jsonl", path=DEFAULT_TRACE_PATH, otlp_endpoint=None, service_name="read_email"):
+    """
+    启用追踪, exporter 为 jsonl 或 otlp; 重复调用时替换之前的导出器
+    """
+    global _exporter
+    if _exporter is not None:
+        _exporter.close()
+    if exporter == "otlp":
+        _exporter = OtlpExporter(otlp_endpoint, service_name)
+        logger.info("追踪已启用, OTLP 导出到 %s", otlp_endpoint or "默认地址")
+    else:
+        _exporter = JsonLinesExporter(path)
+        logger.info("追踪已启用, 写入 %s", path)
+
+
+def shutdown():
+    """关闭导出器, 写出剩余的 span"""
+    global _exporter
+    if _exporter is not None:
+        _exporter.close()
+        _exporter = None
+
+
+def enabled():
+    return _exporter is not None
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    记录一个 span, 在当前 span 内调用时作为其子 span; 异常会标记在 span 上并继续抛出
+    """
+    exporter = _exporter
+    if exporter is None:
+        yield _NOOP_SPAN
+        return
+    current = Span(name, _current_span.get(), attributes)
+    exporter.start(current)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        try:
+            exporter.end(current)
+        except Exception as e:
+            logger.error("导出 span %s 时出错: %s", name, e)
+
+
+def summarize(path, slowest=5, root_name="account_check"):
+    """
+    汇总 JSON 行文件: 各阶段的次数和耗时分位数, 以及最慢的几次账号检查的阶段拆分
+    """
+    spans_by_trace = {}
+    durations = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            spans_by_trace.setdefault(record["trace_id"], []).append(record)
+            durations.setdefault(record["name"], []).append(record["duration_ms"])
+
+    print(f"{'stage':<20}{'n':>8}{'p50 ms':>12}{'p95 ms':>12}{'max ms':>12}")
+    for name, values in sorted(durations.items()):
+        values.sort()
+        p50 = values[len(values) // 2]
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"{name:<20}{len(values):>8}{p50:>12.0f}{p95:>12.0f}{values[-1]:>12.0f}")
+
+    roots = [record for records in spans_by_trace.values() for record in records if record["name"] == root_name]
+    roots.sort(key=lambda record: record["duration_ms"], reverse=True)
+    for root in roots[:slowest]:
+        attributes = root["attributes"]
+        print(f"\n{attributes.get('email_address')} ({attributes.get('ads_browser_id')}, "
+              f"{attributes.get('worker_id')}) {root['duration_ms'] / 1000:.1f} 秒, {root['status']}")
+        stages = {}
+        for record in spans_by_trace[root["trace_id"]]:
+            if record["span_id"] != root["span_id"]:
+                stages[record["name"]] = stages.get(record["name"], 0.0) + record["duration_ms"]
+        for name, total in sorted(stages.items(), key=lambda item: item[1], reverse=True):
+            print(f"    {name:<18}{total / 1000:>8.1f} 秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="汇总 read_email 的追踪文件")
+    parser.add_argument("path", nargs="?", default=DEFAULT_TRACE_PATH)
+    parser.add_argument("--slowest", type=int, default=5, help="输出最慢的几次账号检查的阶段拆分")
+    args = parser.parse_args()
+    summarize(args.path, args.slowest)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,24 +2,18 @@ from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 import time
-import requests
+from adspower_client import DEFAULT_API_URL, get_client
 
 # 配置 AdsPower WebDriver
-ads_power_webdriver_url = "http://local.adspower.net:50325/api/v2/browser-profile/start"
+client = get_client(DEFAULT_API_URL)
 
 def get_ads_browser(profile_id):
     """
     用API查询ads浏览器环境
     """
-    param = {
-        "profile_id": str(profile_id),
-        "proxy_detection": "0",
-        "headless": "0"
-    }
-    res = requests.post(ads_power_webdriver_url, json=param)
-    ads_data = res.json()
+    ads_data = client.start_profile(str(profile_id), headless="0")
     print(ads_data)
-    sel = ads_data['data']['ws']['selenium']
+    sel = ads_data['ws']['selenium']
 
     return sel
 
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+EmailWorkerPool 关闭检查: 在不同的队列长度和并发上限下提交任务后调用 stop, 确认所有线程都能退出
+stop 卡住时 main_loop 在 Ctrl+C 后无法退出, supervisor 只能在超时后强制终止 worker
+
+用法:
+    python worker_pool_check.py
+"""
+import sys
+import time
+import logging
+
+from read_email import EmailWorkerPool
+
+
+logger = logging.getLogger(__name__)
+
+# (线程数, 队列长度, 并发上限)
+SCENARIOS = (
+    (5, None, None),
+    (8, 2, None),
+    (8, 1, 1),
+    (8, 10, 3),
+)
+
+
+def check_stop(worker_count, queue_size, limit, tasks=3, timeout=5):
+    """提交 tasks 个任务后停止线程池, 返回 (是否全部退出, 已完成任务数, 耗时)"""
+    done = []
+    pool = EmailWorkerPool(lambda item: (time.sleep(0.1), done.append(item)), worker_count, queue_size)
+    pool.start()
+    if limit:
+        pool.set_limit(limit)
+    for i in range(tasks):
+        pool.submit(i)
+    start = time.perf_counter()
+    stopped = pool.stop(timeout=timeout)
+    return stopped, len(done), time.perf_counter() - start
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s-%(levelname)s - %(module)s: %(message)s')
+    failed = 0
+    for worker_count, queue_size, limit in SCENARIOS:
+        stopped, completed, seconds = check_stop(worker_count, queue_size, limit)
+        ok = stopped and completed == 3
+        failed += not ok
+        logger.info("线程数 %d, 队列长度 %s, 并发上限 %s: %s, 完成 %d 个任务, 停止耗时 %.2f 秒",
+                    worker_count, queue_size, limit, "通过" if ok else "失败", completed, seconds)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
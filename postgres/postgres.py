@@ -1,12 +1,26 @@
 import psycopg2
-from psycopg2 import Error
+from psycopg2 import Error, sql
 from psycopg2.extras import execute_values
 from dotenv import load_dotenv
+from itertools import islice
 import os
+import re
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
 
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
+def content_hash(email_title, email_content):
+    """邮件内容哈希, 与 outlook/read_email.py 的 content_hash 一致: 标题和正文折叠空白、转小写后计算 sha256"""
+    normalized = "\x1f".join(
+        re.sub(r'\s+', ' ', value or '').strip().lower() for value in (email_title, email_content)
+    )
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
 class PostgresDBManager:
     def __init__(self):
         """初始化数据库连接"""
@@ -42,7 +56,8 @@ class PostgresDBManager:
                     create_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                     email_address VARCHAR(255) NOT NULL,
                     email_title VARCHAR(255),
-                    email_content TEXT
+                    email_content TEXT,
+                    content_hash CHAR(64)
                 );
             '''
             self.cursor.execute(create_table_query)
@@ -70,7 +85,13 @@ class PostgresDBManager:
                     is_need_check INTEGER DEFAULT 0,
                     need_check_time TIMESTAMP,
                     stop_time TIMESTAMP,
-                    remark TEXT
+                    remark TEXT,
+                    claimed_by VARCHAR(255),
+                    claim_expire_time TIMESTAMP,
+                    last_check_status VARCHAR(32),
+                    fail_count INTEGER NOT NULL DEFAULT 0,
+                    next_retry_time TIMESTAMP,
+                    last_error TEXT
                 );
             '''
             self.cursor.execute(create_table_query)
@@ -80,17 +101,32 @@ class PostgresDBManager:
             print("创建 outlook_email_list 表时出错:", error)
 
     def insert_email_content(self, email_address, email_title, email_content):
-        """向 outlook_email_content 表插入数据"""
+        """向 outlook_email_content 表插入数据, 同时写入 content_hash, 同一邮箱下内容相同的邮件跳过"""
         try:
             insert_query = '''
-                INSERT INTO outlook_email_content (email_address, email_title, email_content)
-                VALUES (%s, %s, %s);
+                INSERT INTO outlook_email_content (email_address, email_title, email_content, content_hash)
+                SELECT %(address)s, %(title)s, %(content)s, %(hash)s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM outlook_email_content
+                    WHERE email_address = %(address)s AND content_hash = %(hash)s
+                )
+                ON CONFLICT DO NOTHING;
             '''
-            self.cursor.execute(insert_query, (email_address, email_title, email_content))
+            self.cursor.execute(insert_query, {
+                "address": email_address,
+                "title": email_title,
+                "content": email_content,
+                "hash": content_hash(email_title, email_content),
+            })
+            inserted = self.cursor.rowcount
             self.connection.commit()
-            print("outlook_email_content 表插入数据成功")
+            if inserted:
+                print("outlook_email_content 表插入数据成功")
+            else:
+                print("outlook_email_content 表已有相同内容的邮件, 跳过")
         except (Exception, Error) as error:
             print("插入 outlook_email_content 数据时出错:", error)
+            self.connection.rollback()
 
     def insert_email_list(self, address, password, source=None, ads_browser_id=None, 
                          ads_browser_num=None, proxy_ip=None, proxy_country=None, 
@@ -151,19 +187,61 @@ class PostgresDBManager:
             print("插入 outlook_email_list 数据时出错:", error)
             self.connection.rollback()
 
-    def query_table(self, table_name):
-        """查询指定表的所有数据"""
-        try:
-            query = f'SELECT * FROM {table_name};'
-            self.cursor.execute(query)
-            rows = self.cursor.fetchall()
-            print(f"{table_name} 表查询结果:")
+    def iter_table(self, table_name, columns=None, filters=None, page_size=1000, key_column="id"):
+        """
+        按 key_column 做 keyset 分页, 逐行流式返回表数据, 每页 page_size 行, 与 outlook/read_email.py 中的实现一致
+        key_column 可以是任意可排序的唯一列; columns: 查询的列名列表, 默认全部; filters: {列名: 值} 等值过滤
+        出错时回滚并抛出异常
+        """
+        projection = (sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+                      if columns else sql.SQL('*'))
+        conditions = [sql.SQL('{} = %s').format(sql.Identifier(column)) for column in (filters or {})]
+        params = list((filters or {}).values())
+        key = sql.Identifier(key_column)
+        first_page = sql.SQL('SELECT {key}, {projection} FROM {table}{where} ORDER BY {key} LIMIT %s').format(
+            key=key,
+            projection=projection,
+            table=sql.Identifier(table_name),
+            where=sql.SQL(' WHERE ') + sql.SQL(' AND ').join(conditions) if conditions else sql.SQL(''),
+        )
+        next_page = sql.SQL('SELECT {key}, {projection} FROM {table} WHERE {key} > %s{extra} ORDER BY {key} LIMIT %s').format(
+            key=key,
+            projection=projection,
+            table=sql.Identifier(table_name),
+            extra=sql.SQL('').join(sql.SQL(' AND ') + condition for condition in conditions),
+        )
+        last_key = None
+        while True:
+            try:
+                if last_key is None:
+                    self.cursor.execute(first_page, params + [page_size])
+                else:
+                    self.cursor.execute(next_page, [last_key] + params + [page_size])
+                rows = self.cursor.fetchall()
+                self.connection.commit()
+            except (Exception, Error) as error:
+                logger.error("遍历 %s 表时出错: %s", table_name, error)
+                self.connection.rollback()
+                raise
             for row in rows:
-                print(row)
-            return rows
-        except (Exception, Error) as error:
-            print(f"查询 {table_name} 表时出错:", error)
-            return []
+                yield row[1:]
+            if len(rows) < page_size:
+                return
+            last_key = rows[-1][0]
+
+    def query_table(self, table_name, columns=None, filters=None):
+        """查询指定表的所有数据并返回列表; 大表请使用 iter_table 流式遍历或 preview_table 只看前几行"""
+        rows = list(self.iter_table(table_name, columns=columns, filters=filters))
+        print(f"{table_name} 表查询结果: 共 {len(rows)} 行")
+        return rows
+
+    def preview_table(self, table_name, columns=None, filters=None, limit=20):
+        """打印并返回指定表的前 limit 行, 读到 limit 行即停止, 不读取整张表"""
+        rows = list(islice(self.iter_table(table_name, columns=columns, filters=filters, page_size=limit), limit))
+        print(f"{table_name} 表前 {len(rows)} 行:")
+        for row in rows:
+            print(row)
+        return rows
 
     def alter_email_content_table(self, column_name, column_type, constraint=None):
         """修改 outlook_email_content 表，添加新列"""
@@ -527,8 +605,8 @@ if __name__ == "__main__":
     # db_manager.create_email_list_table()
 
     # 查询表数据
-    # db_manager.query_table("outlook_email_content")
-    # db_manager.query_table("outlook_email_list")
+    # db_manager.preview_table("outlook_email_content")
+    # db_manager.preview_table("outlook_email_list")
 
     # 修改表结构（示例：添加新列）
     # db_manager.alter_email_content_table("status", "VARCHAR(50)")